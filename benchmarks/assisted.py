@@ -0,0 +1,128 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from evalue import getprompt, getprompts, loaddata, preparedata
+from models import registry, streaming
+
+
+def getjobs(dataset, count, noise_rate, passage_num):
+    system, instruction = getprompts(dataset, False)
+    instances = loaddata(dataset)
+    jobs = []
+    for instance in instances:
+        if len(jobs) == count:
+            break
+        try:
+            query, ans, docs = preparedata(instance, noise_rate, passage_num, dataset, 0)
+        except Exception:
+            continue
+        text, usesystem = getprompt(query, docs, instruction)
+        jobs.append((text, system if usesystem else None))
+    return jobs
+
+
+def run(model, jobs, max_new_tokens):
+    '''Greedy responses of jobs, with the decode tokens/s and the acceptance of a draft model if any.'''
+    model.generate(jobs[0][0], 0, jobs[0][1], max_new_tokens=4)
+    outputs = []
+    tokens = 0
+    seconds = 0.0
+    drafted = accepted = 0
+    for text, system in jobs:
+        outputs.append(model.generate(text, 0, system, max_new_tokens=max_new_tokens))
+        stats = streaming.getstats()
+        tokens += stats['completion_tokens']
+        seconds += stats['seconds']
+        if 'assisted' in stats:
+            drafted += stats['assisted']['drafted']
+            accepted += stats['assisted']['accepted']
+    return outputs, {
+        'tokens': tokens,
+        'seconds': round(seconds, 4),
+        'tokens_per_s': round(tokens / seconds, 2),
+        'acceptance': round(accepted / drafted, 4) if drafted else None,
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='measure the speedup of assisted generation with a draft model and check that greedy outputs are unchanged')
+
+    parser.add_argument(
+        '--modelname', type=str, required=True,
+        help='model name, as for evalue.py'
+    )
+    parser.add_argument(
+        '--plm', type=str, default=None,
+        help='name of plm'
+    )
+    parser.add_argument(
+        '--draft_plm', type=str, required=True,
+        help='draft model with the same tokenizer'
+    )
+    parser.add_argument(
+        '--model_module', type=str, nargs='*', default=[],
+        help='modules to import before the model is chosen'
+    )
+    parser.add_argument(
+        '--dataset', type=str, default='en_fact',
+        help='dataset the prompts are taken from'
+    )
+    parser.add_argument(
+        '--noise_rate', type=float, default=0.4,
+        help='rate of noisy passages'
+    )
+    parser.add_argument(
+        '--passage_num', type=int, default=5,
+        help='number of external passages'
+    )
+    parser.add_argument(
+        '--prompts', type=int, default=8,
+        help='number of prompts'
+    )
+    parser.add_argument(
+        '--max_new_tokens', type=int, default=128,
+        help='max response length'
+    )
+    parser.add_argument(
+        '--output', type=str, default=None,
+        help='path of a JSON report'
+    )
+
+    args = parser.parse_args()
+
+    for module in args.model_module:
+        importlib.import_module(module)
+    model = registry.getmodel(args.modelname, args)
+    jobs = getjobs(args.dataset, args.prompts, args.noise_rate, args.passage_num)
+
+    # assisted generation cannot start from the prefix cache, so the plain
+    # run does not use it either and only the draft model differs
+    model.prefix_cache_size = 0
+    baseline, plain = run(model, jobs, args.max_new_tokens)
+    model.setdraft(args.draft_plm)
+    outputs, assisted = run(model, jobs, args.max_new_tokens)
+
+    mismatches = sum(1 for a, b in zip(baseline, outputs) if a != b)
+    report = {
+        'model': args.modelname,
+        'plm': args.plm,
+        'draft_plm': args.draft_plm,
+        'prompts': len(jobs),
+        'plain': plain,
+        'assisted': assisted,
+        'speedup': round(assisted['tokens_per_s'] / plain['tokens_per_s'], 3),
+        'mismatches': mismatches,
+    }
+    print(f"plain    {plain['tokens_per_s']:9.2f} tokens/s")
+    print(f"assisted {assisted['tokens_per_s']:9.2f} tokens/s, acceptance {assisted['acceptance']}")
+    print(f"speedup {report['speedup']}x, {mismatches} of {len(jobs)} greedy outputs differ")
+    if args.output:
+        json.dump(report, open(args.output, 'w'), indent=4)
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,61 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    'evalue --help': [sys.executable, 'evalue.py', '--help'],
+    'reject_evalue --help': [sys.executable, 'reject_evalue.py', '--help'],
+    'fact_evalue --help': [sys.executable, 'fact_evalue.py', '--help'],
+    'rescore --help': [sys.executable, 'rescore.py', '--help'],
+    'chatgpt backend': [sys.executable, '-c', 'from models import registry; registry.getbackend("chatgpt").load()'],
+}
+
+HEAVY = ['torch', 'transformers', 'numpy', 'google.genai']
+
+
+def timecommand(command, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def heavymodules():
+    '''Heavy modules imported by `import evalue` (which should be none).'''
+    code = f'import sys, evalue; print(",".join(m for m in {HEAVY!r} if m in sys.modules))'
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return [m for m in output.strip().split(',') if m]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='measure the startup time of the command line tools')
+
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='number of runs per command, the median is reported'
+    )
+    parser.add_argument(
+        '--target', type=float, default=1.0,
+        help='startup time target in seconds'
+    )
+
+    args = parser.parse_args()
+
+    failed = False
+    for name, command in COMMANDS.items():
+        seconds = timecommand(command, args.repeat)
+        status = 'ok' if seconds < args.target else 'SLOW'
+        failed |= seconds >= args.target
+        print(f'{name:24s} {seconds:6.3f}s  {status}')
+    heavy = heavymodules()
+    print('heavy modules imported by evalue:', ', '.join(heavy) or 'none')
+    sys.exit(1 if failed or heavy else 0)
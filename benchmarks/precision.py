@@ -0,0 +1,108 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assisted import getjobs, run
+from models import devices, registry
+
+
+def measure(args, precision, jobs):
+    '''Load time, weight footprint, greedy outputs and decode rate of the model in one precision.'''
+    devices.configure(args.device, precision)
+    start = time.perf_counter()
+    model = registry.getmodel(args.modelname, args)
+    load = time.perf_counter() - start
+    size = devices.footprint(getattr(model, 'model', None))
+    outputs, stats = run(model, jobs, args.max_new_tokens)
+    del stats['acceptance']
+    stats['load_seconds'] = round(load, 3)
+    stats['footprint_mb'] = None if size is None else round(size / 2**20, 2)
+    return outputs, stats
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='compare the weight footprint, tokens/s and greedy outputs of a local model in fp32 and lower precisions')
+
+    parser.add_argument(
+        '--modelname', type=str, required=True,
+        help='model name, as for evalue.py'
+    )
+    parser.add_argument(
+        '--plm', type=str, default=None,
+        help='name of plm'
+    )
+    parser.add_argument(
+        '--model_module', type=str, nargs='*', default=[],
+        help='modules to import before the model is chosen'
+    )
+    parser.add_argument(
+        '--device', type=str, default='cpu',
+        help='device the model is loaded on'
+    )
+    parser.add_argument(
+        '--precisions', type=str, nargs='+', default=['bf16', 'int8'],
+        help='precisions compared with fp32',
+        choices=devices.PRECISIONS
+    )
+    parser.add_argument(
+        '--dataset', type=str, default='en_fact',
+        help='dataset the prompts are taken from'
+    )
+    parser.add_argument(
+        '--noise_rate', type=float, default=0.4,
+        help='rate of noisy passages'
+    )
+    parser.add_argument(
+        '--passage_num', type=int, default=5,
+        help='number of external passages'
+    )
+    parser.add_argument(
+        '--prompts', type=int, default=8,
+        help='number of prompts'
+    )
+    parser.add_argument(
+        '--max_new_tokens', type=int, default=128,
+        help='max response length'
+    )
+    parser.add_argument(
+        '--output', type=str, default=None,
+        help='path of a JSON report'
+    )
+
+    args = parser.parse_args()
+
+    for module in args.model_module:
+        importlib.import_module(module)
+    jobs = getjobs(args.dataset, args.prompts, args.noise_rate, args.passage_num)
+
+    baseline, fp32 = measure(args, 'fp32', jobs)
+    results = {'fp32': fp32}
+    print(f"fp32 {fp32['footprint_mb']:9.2f} MB {fp32['tokens_per_s']:9.2f} tokens/s")
+    for precision in args.precisions:
+        if precision == 'fp32':
+            continue
+        outputs, stats = measure(args, precision, jobs)
+        stats['agreement'] = round(sum(1 for a, b in zip(baseline, outputs) if a == b) / len(jobs), 4)
+        stats['memory_ratio'] = round(stats['footprint_mb'] / fp32['footprint_mb'], 3) if stats['footprint_mb'] and fp32['footprint_mb'] else None
+        stats['speedup'] = round(stats['tokens_per_s'] / fp32['tokens_per_s'], 3)
+        results[precision] = stats
+        print(f"{precision} {stats['footprint_mb']:9.2f} MB {stats['tokens_per_s']:9.2f} tokens/s, "
+              f"{stats['memory_ratio']}x the memory and {stats['speedup']}x the speed of fp32, "
+              f"{stats['agreement']:.0%} of the greedy outputs the same")
+
+    report = {
+        'model': args.modelname,
+        'plm': args.plm,
+        'device': args.device,
+        'prompts': len(jobs),
+        'results': results,
+    }
+    if args.output:
+        json.dump(report, open(args.output, 'w'), indent=4)
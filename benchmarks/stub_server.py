@@ -0,0 +1,183 @@
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    OpenAI/Groq-compatible chat completions endpoint (any POST path) that
+    answers after a configurable latency, fails a fraction of the requests
+    with 500 and answers 429 with Retry-After above a request rate.
+    Requests with "stream": true get a server-sent events stream with one
+    chunk per word, token_latency seconds apart.
+    '''
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes; with Nagle on, the body
+    # waits for the client's delayed ACK of the headers (about 40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        settings = self.server.settings
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        request = json.loads(body)
+
+        if not self.server.admit():
+            self.reply(429, {'error': {'message': 'rate limit exceeded'}}, {
+                'Retry-After': str(settings['retry_after']),
+                'x-ratelimit-limit-requests': str(int(settings['rate_limit'] * 60)),
+                'x-ratelimit-remaining-requests': '0',
+                'x-ratelimit-reset-requests': f"{settings['retry_after']}s",
+            })
+            return
+        latency = settings['latency'] + random.uniform(0, settings['jitter'])
+        time.sleep(latency)
+        if random.random() < settings['error_rate']:
+            self.reply(500, {'error': {'message': 'stub server error'}})
+            return
+
+        messages = request.get('messages') or [{'content': ''}]
+        prompt = str(messages[-1].get('content', ''))
+        content = settings['response'] or 'stub: ' + prompt[:40]
+        usage = {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4, 'total_tokens': (len(prompt) + len(content)) // 4}
+        if request.get('stream'):
+            self.stream(request, content, usage if (request.get('stream_options') or {}).get('include_usage') else None)
+            return
+        self.reply(200, {
+            'id': 'stub',
+            'object': 'chat.completion',
+            'model': request.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': usage,
+        })
+
+    def stream(self, request, content, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        words = content.split(' ')
+        try:
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(self.server.settings['token_latency'])
+                delta = {'content': word if i == 0 else ' ' + word}
+                self.event({'id': 'stub', 'object': 'chat.completion.chunk', 'model': request.get('model'), 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})
+            self.event({'id': 'stub', 'object': 'chat.completion.chunk', 'model': request.get('model'), 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+            if usage is not None:
+                self.event({'id': 'stub', 'object': 'chat.completion.chunk', 'model': request.get('model'), 'choices': [], 'usage': usage})
+            self.chunk(b'data: [DONE]\n\n')
+            self.chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            # the client closed the stream early (e.g. --early_stop)
+            self.close_connection = True
+
+    def event(self, payload):
+        self.chunk(('data: ' + json.dumps(payload, ensure_ascii=False) + '\n\n').encode('utf-8'))
+
+    def chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def reply(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, settings):
+        super().__init__(address, StubHandler)
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.window = []
+
+    def admit(self):
+        '''Sliding one-second window of admitted requests for the rate limit.'''
+        if not self.settings['rate_limit']:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            self.window = [t for t in self.window if t > now - 1]
+            if len(self.window) >= self.settings['rate_limit']:
+                return False
+            self.window.append(now)
+            return True
+
+
+def start(port=0, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0, retry_after=0.2, response=None, token_latency=0.0):
+    '''Start a stub server on a background thread and return it (its port is server.server_port).'''
+    settings = {
+        'latency': latency,
+        'jitter': jitter,
+        'error_rate': error_rate,
+        'rate_limit': rate_limit,
+        'retry_after': retry_after,
+        'response': response,
+        'token_latency': token_latency,
+    }
+    server = StubServer(('127.0.0.1', port), settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def addarguments(parser):
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='seconds before every response'
+    )
+    parser.add_argument(
+        '--jitter', type=float, default=0.0,
+        help='random extra latency of up to this many seconds'
+    )
+    parser.add_argument(
+        '--error_rate', type=float, default=0.0,
+        help='fraction of requests answered with 500'
+    )
+    parser.add_argument(
+        '--rate_limit', type=float, default=0,
+        help='requests per second above which requests are answered with 429, 0 for no limit'
+    )
+    parser.add_argument(
+        '--retry_after', type=float, default=0.2,
+        help='Retry-After seconds of 429 responses'
+    )
+    parser.add_argument(
+        '--token_latency', type=float, default=0.0,
+        help='seconds between the chunks of streamed responses'
+    )
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='local OpenAI-compatible stub server for benchmarks and offline tests')
+
+    parser.add_argument(
+        '--port', type=int, default=0,
+        help='port to listen on, 0 for any free port'
+    )
+    addarguments(parser)
+
+    args = parser.parse_args()
+
+    server = start(args.port, args.latency, args.jitter, args.error_rate, args.rate_limit, args.retry_after, token_latency=args.token_latency)
+    print(f'listening on {server.server_port}', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
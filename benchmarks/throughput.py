@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from judge import getdata
+from models import ratelimit, transport
+from models.api import Llama3Model, OpenAIAPIModel, QwenGroq
+from timing import percentile
+
+
+# Every client is a function (url) -> generate(text, temperature).
+CLIENTS = {
+    'openai': lambda url: OpenAIAPIModel('stub', url=url).generate,
+    'llama3': lambda url: Llama3Model('stub', url=url).generate,
+    'qwengroq': lambda url: QwenGroq('stub', url=url).generate,
+    'judge': lambda url: lambda text, temperature: getdata(text, url, 'stub'),
+}
+
+PROMPT = 'Document:\n' + '\n'.join(f'Passage {i}: ' + 'The quick brown fox jumps over the lazy dog. ' * 12 for i in range(5)) + ' \n\nQuestion:\nWho jumps?'
+
+
+def startstub(args):
+    '''Run the stub server in its own process, so it does not compete with the client for the GIL.'''
+    command = [
+        sys.executable, os.path.join(ROOT, 'benchmarks', 'stub_server.py'),
+        '--latency', str(args.latency), '--jitter', str(args.jitter),
+        '--error_rate', str(args.error_rate), '--rate_limit', str(args.rate_limit),
+        '--retry_after', str(args.retry_after),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith('listening on '):
+        process.kill()
+        raise RuntimeError(f'stub server did not start: {line!r}')
+    return process, int(line.split()[-1])
+
+
+def run(client, url, concurrency, requests, args):
+    ratelimit.configure(args.rpm, None)
+    transport.configure(max(10, concurrency), max_retries=args.max_retries)
+    generate = CLIENTS[client](url)
+
+    def call(i):
+        start = time.perf_counter()
+        try:
+            response = generate(PROMPT, 0.7)
+            ok = not response.startswith(('Error', 'Request failed'))
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    for i in range(min(concurrency, 4)):
+        call(i)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, range(requests)))
+    seconds = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    limiter = ratelimit.getlimiter(url.split('/')[2])
+    return {
+        'client': client,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': sum(1 for _, ok in results if not ok),
+        'throttled': limiter.stats()['throttled'],
+        'seconds': round(seconds, 4),
+        'req_per_s': round(requests / seconds, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    '''Print the change of req/s against a baseline report and return the regressions.'''
+    old = {(row['client'], row['concurrency']): row for row in baseline['results']}
+    regressions = []
+    for row in results:
+        before = old.get((row['client'], row['concurrency']))
+        if before is None:
+            continue
+        ratio = row['req_per_s'] / before['req_per_s']
+        flag = ''
+        if ratio < 1 - tolerance:
+            flag = '  REGRESSION'
+            regressions.append(row)
+        print(f"{row['client']:10s} c={row['concurrency']:<4d} {before['req_per_s']:9.2f} -> {row['req_per_s']:9.2f} req/s ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def getcommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='measure req/s and latency of the API clients against a local stub server')
+
+    parser.add_argument(
+        '--clients', type=str, nargs='+', default=list(CLIENTS),
+        help='clients to benchmark',
+        choices=list(CLIENTS)
+    )
+    parser.add_argument(
+        '--concurrency', type=int, nargs='+', default=[1, 4, 16],
+        help='concurrency levels'
+    )
+    parser.add_argument(
+        '--requests', type=int, default=200,
+        help='number of requests per client and concurrency level'
+    )
+    parser.add_argument(
+        '--latency', type=float, default=0.02,
+        help='seconds the stub server waits before every response'
+    )
+    parser.add_argument(
+        '--jitter', type=float, default=0.0,
+        help='random extra latency of the stub server of up to this many seconds'
+    )
+    parser.add_argument(
+        '--error_rate', type=float, default=0.0,
+        help='fraction of requests the stub server answers with 500'
+    )
+    parser.add_argument(
+        '--rate_limit', type=float, default=0,
+        help='requests per second above which the stub server answers 429, 0 for no limit'
+    )
+    parser.add_argument(
+        '--retry_after', type=float, default=0.2,
+        help='Retry-After seconds of the 429 responses'
+    )
+    parser.add_argument(
+        '--rpm', type=float, default=None,
+        help='requests per minute the client is configured with'
+    )
+    parser.add_argument(
+        '--max_retries', type=int, default=8,
+        help='retries of the client transport'
+    )
+    parser.add_argument(
+        '--output', type=str, default='benchmarks/throughput.json',
+        help='path of the JSON report'
+    )
+    parser.add_argument(
+        '--baseline', type=str, default=None,
+        help='JSON report of an earlier run to compare with'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='relative drop of req/s against the baseline that counts as a regression'
+    )
+
+    args = parser.parse_args()
+
+    process, port = startstub(args)
+    url = f'http://127.0.0.1:{port}/v1/chat/completions'
+    results = []
+    try:
+        for client in args.clients:
+            for concurrency in args.concurrency:
+                row = run(client, url, concurrency, args.requests, args)
+                results.append(row)
+                print(f"{client:10s} c={concurrency:<4d} {row['req_per_s']:9.2f} req/s  p50 {row['p50_ms']:8.2f} ms  p95 {row['p95_ms']:8.2f} ms  p99 {row['p99_ms']:8.2f} ms  errors {row['errors']}")
+    finally:
+        process.kill()
+
+    report = {
+        'commit': getcommit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'tolerance')},
+        'results': results,
+    }
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    json.dump(report, open(args.output, 'w'), indent=4)
+    print('Report written to', args.output)
+
+    if args.baseline:
+        regressions = compare(results, json.load(open(args.baseline)), args.tolerance)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+
+POLICIES = ['none', 'drop', 'truncate']
+
+
+def estimatetokens(text):
+    '''Token estimate without a tokenizer: 4 ASCII characters or 1 other character per token.'''
+    ascii = sum(1 for char in text if ord(char) < 128)
+    return (ascii + 3) // 4 + len(text) - ascii
+
+
+class TokenCounts:
+    '''
+    On-disk cache of token counts, keyed by tokenizer name and a hash of
+    the text. The same passages recur in every noise rate, passage number
+    and model of a sweep, so each one is tokenized once per tokenizer.
+    With path=None the counts are only kept in memory.
+    '''
+
+    def __init__(self, path=None):
+        self.counts = {}
+        self.conn = None
+        self.lock = threading.Lock()
+        self.pending = 0
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS counts ('
+                'tokenizer TEXT NOT NULL, key TEXT NOT NULL, count INTEGER NOT NULL, '
+                'PRIMARY KEY (tokenizer, key))'
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, tokenizer, text, count):
+        '''Token count of text, computed with count(text) on a miss.'''
+        key = (tokenizer, self.key(text))
+        with self.lock:
+            if key in self.counts:
+                return self.counts[key]
+            if self.conn is not None:
+                row = self.conn.execute('SELECT count FROM counts WHERE tokenizer = ? AND key = ?', key).fetchone()
+                if row is not None:
+                    self.counts[key] = row[0]
+                    return row[0]
+        value = count(text)
+        with self.lock:
+            self.counts[key] = value
+            if self.conn is not None:
+                self.conn.execute('INSERT OR REPLACE INTO counts (tokenizer, key, count) VALUES (?, ?, ?)', key + (value,))
+                self.pending += 1
+                if self.pending >= 256:
+                    self.conn.commit()
+                    self.pending = 0
+        return value
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.commit()
+                self.conn.close()
+                self.conn = None
+
+
+def getcontextlength(model, default=4096):
+    '''Context window of a model: its context_length attribute or the HuggingFace config.'''
+    if getattr(model, 'context_length', None):
+        return model.context_length
+    config = getattr(getattr(model, 'model', None), 'config', None)
+    for attr in ('max_position_embeddings', 'seq_length', 'n_positions'):
+        if getattr(config, attr, None):
+            return getattr(config, attr)
+    return default
+
+
+class PromptBudget:
+    '''
+    Fits the docs of a prompt into the context window of a model.
+
+    The tokens left for docs are the context length minus the reserved
+    output tokens, a safety margin and the tokens of the prompt without
+    docs (chat template, system prompt, instruction and query). Docs are
+    taken in order; with policy 'drop' a doc that does not fit is left out
+    and the next ones are still tried, with policy 'truncate' the first doc
+    that does not fit is cut to the remaining tokens and all later docs are
+    left out. fit() returns the docs together with a record of what was
+    done, which evalue.py stores with the prediction.
+
+    Models with a `tokenizer` are measured with it; other models (the API
+    models) with estimatetokens().
+    '''
+
+    def __init__(self, model, context_length=None, max_new_tokens=None, policy='drop', counts=None, margin=16):
+        self.model = model
+        self.context_length = context_length or getcontextlength(model)
+        self.max_new_tokens = max_new_tokens or getattr(model, 'max_new_tokens', 256)
+        self.policy = policy
+        self.counts = counts if counts is not None else TokenCounts()
+        self.margin = margin
+        self.tokenizer = getattr(model, 'tokenizer', None)
+        self.name = getattr(self.tokenizer, 'name_or_path', None) or 'estimate'
+
+    def encode(self, text):
+        return self.tokenizer(text, add_special_tokens=False)['input_ids']
+
+    def count(self, text):
+        '''Token count of a passage, which recurs across configs and is cached.'''
+        return self.counts.get(self.name, text, self.measure)
+
+    def measure(self, text):
+        '''Token count of a text seen once, such as a rendered prompt, which is not cached.'''
+        if self.tokenizer is None:
+            return estimatetokens(text)
+        return len(self.encode(text))
+
+    def render(self, text, system):
+        if hasattr(self.model, 'format_prompt'):
+            return self.model.format_prompt(text, system)
+        return (system or '') + '\n' + text
+
+    def cut(self, doc, tokens):
+        '''Longest prefix of doc with at most `tokens` tokens.'''
+        if self.tokenizer is not None:
+            return self.tokenizer.decode(self.encode(doc)[:tokens], skip_special_tokens=True)
+        used = 0
+        for i, char in enumerate(doc):
+            used += 0.25 if ord(char) < 128 else 1
+            if used > tokens:
+                return doc[:i]
+        return doc
+
+    def fit(self, query, docs, instruction, system):
+        fixed = self.measure(self.render(instruction.format(QUERY=query, DOCS=''), system))
+        budget = self.context_length - self.max_new_tokens - self.margin - fixed
+        remaining = budget
+        kept, dropped, truncated = [], [], None
+        full = False
+        for i, doc in enumerate(docs):
+            # one more token for the newline that joins the docs
+            separator = 1 if kept else 0
+            cost = self.count(doc) + separator
+            if not full and cost <= remaining:
+                kept.append(doc)
+                remaining -= cost
+                continue
+            if self.policy == 'truncate':
+                if not full and remaining > separator:
+                    doc = self.cut(doc, remaining - separator)
+                    remaining -= self.measure(doc) + separator
+                    kept.append(doc)
+                    truncated = i
+                    full = True
+                    continue
+                full = True
+            dropped.append(i)
+        record = {
+            'policy': self.policy,
+            'context_length': self.context_length,
+            'tokens': fixed + budget - remaining,
+            'dropped': dropped,
+            'truncated': truncated,
+        }
+        return kept, record
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# What the API backends return instead of raising when a request fails.
+FAILURES = ('Error: ', 'Request failed: ', 'No response received.')
+
+
+def isfailure(response):
+    '''Whether a response is a failed generation, which must not be cached.'''
+    return not isinstance(response, str) or response.startswith(FAILURES)
+
+
+class GenerationCache:
+    '''
+    On-disk cache of model and judge responses, shared by evalue.py,
+    reject_evalue.py and fact_evalue.py.
+
+    Entries are keyed by a hash of everything that determines the request:
+    model name, system prompt, rendered prompt, temperature, top_p and max
+    tokens. Old entries are evicted by age (max_age, in seconds since last
+    use) and by size (max_entries, least recently used first).
+    '''
+
+    def __init__(self, path, max_entries=None, max_age=None, evict_every=1000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS generations ('
+            'key TEXT PRIMARY KEY, response TEXT NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS generations_accessed ON generations (accessed)')
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def key(model, system, prompt, temperature=None, top_p=None, max_tokens=None):
+        data = json.dumps([model, system, prompt, temperature, top_p, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT response, accessed FROM generations WHERE key = ?', (key,)).fetchone()
+            if row is None or (self.max_age is not None and row[1] < now - self.max_age):
+                self.misses += 1
+                return None
+            self.conn.execute('UPDATE generations SET accessed = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO generations (key, response, created, accessed) VALUES (?, ?, ?, ?)',
+                (key, response, now, now)
+            )
+            self.conn.commit()
+            self.puts += 1
+            evict = self.evict_every and self.puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            if self.max_age is not None:
+                self.conn.execute('DELETE FROM generations WHERE accessed < ?', (time.time() - self.max_age,))
+            if self.max_entries is not None:
+                self.conn.execute(
+                    'DELETE FROM generations WHERE key IN ('
+                    'SELECT key FROM generations ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                )
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM generations').fetchone()[0]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self)}
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.conn.close()
+
+
+class CachedModel:
+    '''
+    Wraps a model so that generate() and generate_batch() consult a
+    GenerationCache before calling it. Arguments left as None are not
+    forwarded, so the wrapped model keeps its own defaults. Failed
+    generations are returned but not stored, so a rerun tries them again.
+    '''
+
+    def __init__(self, model, cache, name):
+        self.model = model
+        self.cache = cache
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self.model, attr)
+
+    def _forward(self, temperature, system, top_p, max_new_tokens):
+        args = [temperature]
+        if system is not None:
+            args.append(system)
+        kwargs = {}
+        if top_p is not None:
+            kwargs['top_p'] = top_p
+        if max_new_tokens is not None:
+            kwargs['max_new_tokens'] = max_new_tokens
+        return args, kwargs
+
+    def generate(self, text, temperature=0.7, system=None, top_p=None, max_new_tokens=None):
+        key = self.cache.key(self.name, system, text, temperature, top_p, max_new_tokens)
+        response = self.cache.get(key)
+        if response is None:
+            args, kwargs = self._forward(temperature, system, top_p, max_new_tokens)
+            response = self.model.generate(text, *args, **kwargs)
+            if not isfailure(response):
+                self.cache.put(key, response)
+        return response
+
+    def generate_batch(self, texts, temperature=0.7, system=None, top_p=None, max_new_tokens=None, batch_size=8):
+        keys = [self.cache.key(self.name, system, text, temperature, top_p, max_new_tokens) for text in texts]
+        responses = [self.cache.get(key) for key in keys]
+        missing = [i for i, response in enumerate(responses) if response is None]
+        if missing:
+            args, kwargs = self._forward(temperature, system, top_p, max_new_tokens)
+            outputs = self.model.generate_batch([texts[i] for i in missing], *args, batch_size=batch_size, **kwargs)
+            for i, response in zip(missing, outputs):
+                responses[i] = response
+                if not isfailure(response):
+                    self.cache.put(keys[i], response)
+        return responses
@@ -0,0 +1,165 @@
+import json
+import mmap
+import os
+import re
+import struct
+from bisect import bisect_left
+from types import MappingProxyType
+
+
+MAGIC = b'RGBOFF01'
+# magic, size and mtime_ns of the data file, number of instances, flags
+HEADER = struct.Struct('<8sQQQQ')
+INTIDS = 1
+SORTEDIDS = 2
+IDPATTERN = re.compile(rb'\s*\{\s*"id"\s*:\s*(-?\d+)\s*[,}]')
+
+
+def freeze(obj):
+    '''Read-only copy of a parsed JSON value: dicts become mapping proxies and lists tuples.'''
+    if isinstance(obj, dict):
+        return MappingProxyType({key: freeze(value) for key, value in obj.items()})
+    if isinstance(obj, list):
+        return tuple(freeze(value) for value in obj)
+    return obj
+
+
+def thaw(obj):
+    '''Mutable copy of a frozen value, e.g. an answer that checkanswer() expects as a list.'''
+    if isinstance(obj, (dict, MappingProxyType)):
+        return {key: thaw(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(value) for value in obj]
+    return obj
+
+
+class Dataset:
+    '''
+    Read-only, memory-mapped view of a JSON-lines dataset file.
+
+    The byte offset of every line and the integer id of every instance are
+    kept in a binary index next to the file (`filename + '.offsets'`), which
+    is rebuilt when the size or modification time of the file changes. Both
+    files are memory-mapped, so opening a dataset does not depend on its
+    size and instances are only read and parsed when they are accessed, by
+    position (dataset[i]) or by id (dataset.byid(id)). Instances are frozen
+    (see freeze()) so that they cannot be changed by the code that samples
+    documents from them.
+
+    If the index cannot be written (e.g. a read-only data directory) it is
+    kept in memory.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.indexfile = filename + '.offsets'
+        self.f = open(filename, 'rb')
+        stat = os.fstat(self.f.fileno())
+        self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        self.index = self._loadindex(stat)
+        if self.index is None:
+            self.index = self._buildindex(stat)
+        _, _, _, self.count, self.flags = HEADER.unpack_from(self.index, 0)
+        start = HEADER.size
+        self.offsets = memoryview(self.index)[start:start + (self.count + 1) * 8].cast('Q')
+        start += (self.count + 1) * 8
+        self.ids = memoryview(self.index)[start:start + self.count * 8].cast('q')
+        self.positions = None
+        self.idlist = None
+
+    def _loadindex(self, stat):
+        try:
+            with open(self.indexfile, 'rb') as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(index) >= HEADER.size:
+            magic, size, mtime, count, _ = HEADER.unpack_from(index, 0)
+            if magic == MAGIC and size == stat.st_size and mtime == stat.st_mtime_ns \
+                    and len(index) == HEADER.size + (2 * count + 1) * 8:
+                return index
+        index.close()
+        return None
+
+    def _buildindex(self, stat):
+        offsets, ids = [], []
+        offset = 0
+        size = len(self.data)
+        while offset < size:
+            end = self.data.find(b'\n', offset)
+            end = size if end < 0 else end + 1
+            line = self.data[offset:end]
+            if line.strip():
+                match = IDPATTERN.match(line)
+                id = int(match.group(1)) if match else json.loads(line)['id']
+                offsets.append(offset)
+                ids.append(id)
+            offset = end
+        offsets.append(size)
+        flags = 0
+        if all(type(id) is int for id in ids):
+            flags |= INTIDS
+            if all(a < b for a, b in zip(ids, ids[1:])):
+                flags |= SORTEDIDS
+        else:
+            ids = [0] * len(ids)
+        index = HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, len(ids), flags)
+        index += struct.pack(f'<{len(offsets)}Q{len(ids)}q', *offsets, *ids)
+        try:
+            with open(self.indexfile + '.tmp', 'wb') as f:
+                f.write(index)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.indexfile + '.tmp', self.indexfile)
+        except OSError:
+            pass
+        return index
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return freeze(json.loads(self.data[self.offsets[i]:self.offsets[i + 1]]))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def position(self, id):
+        '''Position of the instance with the given id, or None.'''
+        if self.flags & SORTEDIDS:
+            i = bisect_left(self.ids, id) if type(id) is int else self.count
+            return i if i < self.count and self.ids[i] == id else None
+        if self.positions is None:
+            # other ids are looked up in a dict built on first use
+            self.positions = {id: i for i, id in enumerate(self.getids())}
+        return self.positions.get(id)
+
+    def byid(self, id):
+        i = self.position(id)
+        if i is None:
+            raise KeyError(id)
+        return self[i]
+
+    def getids(self):
+        '''Ids of all instances in file order.'''
+        if self.flags & INTIDS:
+            return self.ids.tolist()
+        if self.idlist is None:
+            # ids that are not ints are not in the index, so the file is
+            # parsed once and the ids are kept for later calls
+            self.idlist = [json.loads(self.data[self.offsets[i]:self.offsets[i + 1]])['id'] for i in range(self.count)]
+        return list(self.idlist)
+
+    def close(self):
+        if isinstance(self.index, mmap.mmap):
+            self.offsets.release()
+            self.ids.release()
+            self.index.close()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.f.close()
@@ -1,12 +1,26 @@
 import json
-import numpy as np
 import random, math
-import argparse,torch
+import argparse
+import importlib
 import os
+import time
 import json, tqdm, requests
 import yaml
 import warnings
-from models.models import *
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from models import devices, registry, stopping, streaming, transport
+from models.cassette import CassetteMiss
+from cache import GenerationCache, CachedModel
+from journal import PredictionJournal
+from dataset import Dataset, thaw
+from plan import getplan, resolve, sampledocs
+from budget import POLICIES, PromptBudget, TokenCounts
+from workers import ProcessPoolModel, setdraft, setstopping, setstream, setthreads
+from shards import getshard, getshardname, parseshard, writemanifest
+from scoring import checkanswer, getlabels, getscores
+import timing
 import urllib3
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -14,134 +28,186 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 warnings.simplefilter("ignore", category=urllib3.exceptions.InsecureRequestWarning)
 
+DATASETS = ['en','zh','en_int','zh_int','en_fact','zh_fact']
+
 
     
-def processdata(instance, noise_rate, passage_num, filename, correct_rate = 0):
+def processdata(instance, noise_rate, passage_num, filename, correct_rate = 0, rng = random):
     query = instance['query']
-    ans = instance['answer']
-
-    neg_num = math.ceil(passage_num * noise_rate)
-    pos_num = passage_num - neg_num
-
+    ans = thaw(instance['answer'])
     if '_int' in filename:
-        for i in instance['positive']:
-            random.shuffle(i)
         print(len(instance['positive']))
-        docs = [i[0] for i in instance['positive']]
-        if len(docs) < pos_num:
-            maxnum = max([len(i) for i in instance['positive']])
-            for i in range(1,maxnum):
-                for j in instance['positive']:
-                    if len(j) > i:
-                        docs.append(j[i])
-                        if len(docs) == pos_num:
-                            break
-                if len(docs) == pos_num:
-                    break
-        neg_num = passage_num - len(docs)
-        if neg_num > 0:
-            negative = instance['negative'][:neg_num]
-            docs += negative
-    elif '_fact' in filename:
-        correct_num = math.ceil(passage_num * correct_rate)
-        pos_num = passage_num - neg_num - correct_num
-        indexs = list(range(len(instance['positive'])))
-        selected = random.sample(indexs,min(len(indexs),pos_num))
-        docs = [instance['positive_wrong'][i] for i in selected]
-        remain = [i for i in indexs if i not in selected]
-        if correct_num > 0 and len(remain) > 0:
-            docs += [instance['positive'][i] for i in random.sample(remain,min(len(remain),correct_num))]
-        if neg_num > 0:
-            docs += instance['negative'][:neg_num]
-    else:
-        if noise_rate == 1:
-            neg_num = passage_num
-            pos_num = 0
-        else:
-            if neg_num > len(instance['negative']):
-                neg_num = len(instance['negative'])
-                pos_num = passage_num - neg_num
-            elif pos_num > len(instance['positive']):
-                pos_num = len(instance['positive'])
-                neg_num = passage_num - pos_num
-        
-
-        positive = instance['positive'][:pos_num]
-        negative = instance['negative'][:neg_num]
-
-        docs = positive + negative
-
-    random.shuffle(docs)
-    
+    docs = resolve(instance, sampledocs(instance, noise_rate, passage_num, filename, correct_rate, rng))
     return query, ans, docs
 
 
-def checkanswer(prediction, ground_truth):
-    prediction = prediction.lower()
-    if type(ground_truth) is not list:
-        ground_truth = [ground_truth]
-    labels = []
-    for instance in ground_truth:
-        flag = True
-        if type(instance)  == list:
-            flag = False 
-            instance = [i.lower() for i in instance]
-            for i in instance:
-                if i in prediction:
-                    flag = True
-                    break
-        else:
-            instance = instance.lower()
-            if instance not in prediction:
-                flag = False
-        labels.append(int(flag))
-    return labels
+def preparedata(instance, noise_rate, passage_num, filename, correct_rate = 0, plan = None):
+    '''
+    Query, answer and docs of an instance. Without a plan every instance is
+    sampled with a generator seeded with 2333, as in the original loop; with
+    a plan (see plan.getplan) the precompiled docs are used.
+    '''
+    if plan is not None:
+        refs = plan.get(instance['id'])
+        if refs is None:
+            raise ValueError(f"no docs planned for id {instance['id']}")
+        return instance['query'], thaw(instance['answer']), resolve(instance, refs)
+    if passage_num == 0:
+        return instance['query'], thaw(instance['answer']), []
+    return processdata(instance, noise_rate, passage_num, filename, correct_rate, random.Random(2333))
+
+
+def rungeneration(jobs, func, concurrency = 1):
+    '''
+    Apply func to every job and yield the results in job order.
+
+    With concurrency > 1 up to `concurrency` calls are kept in flight on a
+    thread pool, which is meant for API-backed models whose generate() is
+    bound by request latency. Jobs are still drawn from `jobs` in the
+    calling thread, in order.
+    '''
+    if concurrency <= 1:
+        for job in jobs:
+            yield func(job)
+        return
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append(executor.submit(func, job))
+            if len(pending) >= concurrency * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 
 def getevalue(results):
-    results = np.array(results)
-    results = np.max(results,axis = 0)
+    results = [max(labels) for labels in zip(*results)]
     if 0 in results:
         return False
     else:
         return True
             
 
+def getprompt(query, docs, instruction):
+    '''
+    Render the instruction for a query. The second value tells whether the
+    system prompt should be passed to the model (only when docs are given).
+    '''
+    if len(docs) == 0:
+        return instruction.format(QUERY=query, DOCS=''), False
+    docs = '\n'.join(docs)
+    return instruction.format(QUERY=query, DOCS=docs), True
+
+
 def predict(query, ground_truth, docs, model, system, instruction, temperature, dataset):
 
     '''
     label: 0 for positive, 1 for negative, -1 for not enough information
 
     '''
-    if len(docs) == 0:
+    text, usesystem = getprompt(query, docs, instruction)
+    prediction = generateone(model, text, system if usesystem else None, temperature)
 
-        text = instruction.format(QUERY=query, DOCS='')
-        prediction = model.generate(text, temperature)
+    return getlabels(prediction, ground_truth, dataset)
 
-    else:
 
-        docs = '\n'.join(docs)
+def generateone(model, text, system, temperature):
+    if system is None:
+        return model.generate(text, temperature)
+    return model.generate(text, temperature, system)
+
+
+def predictbatch(jobs, model, temperature, batch_size):
+    '''
+    Batched generation for models with generate_batch(). Every job carries
+    its rendered 'text' and 'system' (None for the model default); jobs that
+    share a system prompt are batched together. Returns the predictions in
+    job order.
+    '''
+    predictions = [None] * len(jobs)
+    groups = {}
+    for i, job in enumerate(jobs):
+        groups.setdefault(job['system'], []).append(i)
+    for system, indexs in groups.items():
+        texts = [jobs[i]['text'] for i in indexs]
+        outputs = model.generate_batch(texts, temperature, system, batch_size=batch_size)
+        for i, prediction in zip(indexs, outputs):
+            predictions[i] = prediction
+    return predictions
+
+
+def runbatches(jobs, func, batch_size, window = 8):
+    '''
+    Group jobs into windows of batch_size * window and apply func to every
+    window, which returns one result per job. Results are yielded in job
+    order; the model buckets each window by prompt length.
+    '''
+    chunk = []
+    for job in jobs:
+        chunk.append(job)
+        if len(chunk) >= batch_size * window:
+            yield from func(chunk)
+            chunk = []
+    if chunk:
+        yield from func(chunk)
+
 
-        
+def loaddata(dataset):
+    return Dataset(f'data/{dataset}.json')
 
-        text = instruction.format(QUERY=query, DOCS=docs)
 
-        prediction = model.generate(text, temperature, system)
+def getresultpath(dataset, factchecking = False):
+    if 'en' in dataset:
+        resultpath = 'result-en'
+    elif 'zh' in dataset:
+        resultpath = 'result-zh'
+    if factchecking:
+        resultpath = resultpath + '/fact'
+    return resultpath
 
-    if 'zh' in dataset:
-        prediction = prediction.replace(" ","")
 
-    if '信息不足' in prediction or 'insufficient information' in prediction:
-        labels = [-1]
+def getprompts(dataset, factchecking = False):
+    if factchecking:
+        prompt = yaml.load(open('config/instruction_fact.yaml', 'r'), Loader=yaml.FullLoader)[dataset[:2]]
     else:
-        labels = checkanswer(prediction, ground_truth)
-    
-    factlabel = 0
+        prompt = yaml.load(open('config/instruction.yaml', 'r'), Loader=yaml.FullLoader)[dataset[:2]]
+    return prompt['system'], prompt['instruction']
+
 
-    if '事实性错误' in prediction or 'factual errors' in prediction:
-        factlabel = 1
+def getfilename(resultpath, dataset, modelname, temperature, noise_rate, passage_num, correct_rate):
+    return f'{resultpath}/prediction_{dataset}_{modelname}_temp{temperature}_noise{noise_rate}_passage{passage_num}_correct{correct_rate}'
 
-    return labels,prediction, factlabel
 
+def getsettings(args, budget=None, policy=None, weights=None):
+    '''
+    Settings that change the predictions but not the prediction filename.
+    They are stored with every row, and rows written with other settings
+    are generated again when a run resumes.
+    '''
+    settings = {}
+    if args.plan:
+        settings['plan_seed'] = args.plan_seed
+    if budget is not None:
+        settings['truncation'] = budget.policy
+        settings['context_length'] = budget.context_length
+    if policy is not None:
+        settings['stopping'] = [policy.policy, policy.phrases, policy.max_tokens]
+    if weights is not None:
+        settings['device'], settings['precision'] = weights
+    return settings
+
+
+def getconfigs(args):
+    '''
+    Expand the --sweep_* options into the list of (dataset, noise_rate,
+    passage_num, correct_rate) configs, falling back to the single-valued
+    options for every axis that is not swept.
+    '''
+    datasets = args.sweep_dataset or [args.dataset]
+    noise_rates = args.sweep_noise_rate or [args.noise_rate]
+    passage_nums = args.sweep_passage_num or [args.passage_num]
+    correct_rates = args.sweep_correct_rate or [args.correct_rate]
+    return list(itertools.product(datasets, noise_rates, passage_nums, correct_rates))
 
 
 if __name__ == '__main__':
@@ -152,10 +218,14 @@ if __name__ == '__main__':
         '--modelname', type=str, default='chatgpt',
         help='model name'
     )
+    parser.add_argument(
+        '--model_module', type=str, nargs='*', default=[],
+        help='modules to import before the model is chosen, e.g. to register more backends in models.registry'
+    )
     parser.add_argument(
         '--dataset', type=str, default='en',
         help='evaluetion dataset',
-        choices=['en','zh','en_int','zh_int','en_fact','zh_fact']
+        choices=DATASETS
     )
     parser.add_argument(
         '--api_key', type=str, default='api_key',
@@ -189,141 +259,363 @@ if __name__ == '__main__':
         '--factchecking', type=bool, default=False,
         help='whether to fact checking'
     )
+    parser.add_argument(
+        '--sweep_dataset', type=str, nargs='+', default=None,
+        help='datasets to sweep over in one run',
+        choices=DATASETS
+    )
+    parser.add_argument(
+        '--sweep_noise_rate', type=float, nargs='+', default=None,
+        help='noise rates to sweep over in one run'
+    )
+    parser.add_argument(
+        '--sweep_passage_num', type=int, nargs='+', default=None,
+        help='passage numbers to sweep over in one run'
+    )
+    parser.add_argument(
+        '--sweep_correct_rate', type=float, nargs='+', default=None,
+        help='correct rates to sweep over in one run'
+    )
+    parser.add_argument(
+        '--concurrency', type=int, default=1,
+        help='number of requests kept in flight (for API-backed models)'
+    )
+    parser.add_argument(
+        '--shard', type=str, default=None,
+        help='run only shard i of N (given as i/N, 0 <= i < N) and write its predictions and manifest to separate files for merge_shards.py'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='number of worker processes, each with its own copy of the model (for local models on CPU)'
+    )
+    parser.add_argument(
+        '--torch_threads', type=int, default=None,
+        help='number of torch threads per process, by default the cores divided by the workers'
+    )
+    parser.add_argument(
+        '--batch_size', type=int, default=1,
+        help='number of prompts per generate_batch call (for local HuggingFace models)'
+    )
+    parser.add_argument(
+        '--fsync_every', type=int, default=32,
+        help='number of appended predictions between two fsyncs'
+    )
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='rewrite the prediction files in dataset order at the end of the run'
+    )
+    parser.add_argument(
+        '--cache', type=str, default=None,
+        help='path of the sqlite generation cache, disabled if not given'
+    )
+    parser.add_argument(
+        '--cache_max_entries', type=int, default=None,
+        help='maximum number of cached generations'
+    )
+    parser.add_argument(
+        '--cache_max_age', type=float, default=None,
+        help='maximum age of cached generations in days'
+    )
+    parser.add_argument(
+        '--plan', action='store_true',
+        help='sample the docs of every instance with its own seed from a cached plan file'
+    )
+    parser.add_argument(
+        '--plan_seed', type=int, default=2333,
+        help='seed of the doc sampling plans'
+    )
+    parser.add_argument(
+        '--plan_dir', type=str, default='plans',
+        help='directory of the cached doc sampling plans'
+    )
+    parser.add_argument(
+        '--truncation', type=str, default='none',
+        help='how to fit the docs into the context window: none, drop docs that do not fit, or truncate the first one',
+        choices=POLICIES
+    )
+    parser.add_argument(
+        '--context_length', type=int, default=None,
+        help='context window in tokens, the model\'s own if not given'
+    )
+    parser.add_argument(
+        '--draft_plm', type=str, default=None,
+        help='small model with the same tokenizer that drafts tokens for assisted generation of local models'
+    )
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='stream the responses and keep the time to first token, tokens/s and token counts of each prediction'
+    )
+    parser.add_argument(
+        '--token_cache', type=str, default='token_counts.sqlite',
+        help='path of the sqlite cache of passage token counts'
+    )
     
+    devices.addarguments(parser)
+    stopping.addarguments(parser)
+    transport.addarguments(parser)
+    timing.addarguments(parser)
+
     args = parser.parse_args()
+    shard = None
+    if args.shard:
+        try:
+            shard = parseshard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.workers > 1 and args.truncation != 'none':
+        # the budget needs the tokenizer, prompt template and context length of the model, which live in the workers
+        parser.error('--truncation cannot be used with --workers')
+    if args.early_stop != 'none' and (args.factchecking or any('_fact' in dataset for dataset in args.sweep_dataset or [args.dataset])):
+        # a refusal can be followed by the "factual errors" sentence that decides the factlabel
+        parser.error('--early_stop cannot be used with factchecking or _fact datasets')
+    transport.configurefromargs(args, args.concurrency)
+    devices.configurefromargs(args)
 
     modelname = args.modelname
     temperature = args.temp
-    noise_rate = args.noise_rate
-    passage_num = args.passage_num
-
-    instances = []
-    with open(f'data/{args.dataset}.json','r') as f:
-        for line in f:
-            instances.append(json.loads(line))
-    if 'en' in args.dataset:
-        resultpath = 'result-en'
-    elif 'zh' in args.dataset:
-        resultpath = 'result-zh'
-    if not os.path.exists(resultpath):
-        os.mkdir(resultpath)
 
-    if args.factchecking:
-        prompt = yaml.load(open('config/instruction_fact.yaml', 'r'), Loader=yaml.FullLoader)[args.dataset[:2]]
-        resultpath = resultpath + '/fact'
+    for module in args.model_module:
+        importlib.import_module(module)
+    pool = None
+    concurrency = args.concurrency
+    policy = stopping.fromargs(args)
+    size = None
+    if args.workers > 1:
+        model = pool = ProcessPoolModel(modelname, args, args.workers, args.torch_threads)
+        concurrency = max(concurrency, args.workers)
     else:
-        prompt = yaml.load(open('config/instruction.yaml', 'r'), Loader=yaml.FullLoader)[args.dataset[:2]]
-
-    system = prompt['system']
-    instruction = prompt['instruction']
-
-    if modelname == 'chatgpt':
-        model = OpenAIAPIModel(api_key = args.api_key, url = args.url)
-    elif 'Llama-2' in modelname:
-        #model = LLama2(plm = args.plm)
-        model = Llama2()
-    elif 'Llama-3' in modelname or 'Llama3' in modelname:
-        model = Llama3Model()
-    elif 'chatglm' in modelname:
-        model = ChatglmModel(plm = args.plm)
-    elif 'moss' in modelname:
-        model = Moss(plm = args.plm)
-    elif 'vicuna' in modelname:
-        model = Vicuna(plm = args.plm)
-    # elif 'Qwen' in modelname:
-    #     model = Qwen(plm = args.plm)
-    # elif 'Qwen2' in modelname:
-    #     model = Qwen2(plm = args.plm)
-    elif 'Baichuan' in modelname:
-        model = Baichuan(plm = args.plm)
-    elif 'WizardLM' in modelname:
-        model = WizardLM(plm = args.plm)
-    elif 'BELLE' in modelname:
-        model = BELLE(plm = args.plm)
-    elif 'Qwen' in modelname:
-        #model = QwenChat()
-        model = QwenGroq()
-    elif 'GeminiModel' in modelname:
-        print("GeminiModel")
-        model = GeminiModel()
-    
-
-
-    filename = f'{resultpath}/prediction_{args.dataset}_{modelname}_temp{temperature}_noise{noise_rate}_passage{passage_num}_correct{args.correct_rate}.json'
-    useddata = {}
-    if os.path.exists(filename):
-        with open(filename) as f:
-            for line in f:
-                data = json.loads(line)
-                useddata[data['id']] = data
-  
-    results = []
-    with open(filename,'w') as f:
-        for instance in tqdm.tqdm(instances):
-            if instance['id'] in useddata and instance['query'] == useddata[instance['id']]['query'] and instance['answer']  == useddata[instance['id']]['ans']:
-                results.append(useddata[instance['id']])
-                f.write(json.dumps(useddata[instance['id']], ensure_ascii=False)+'\n')
-                continue
-            try:
-                random.seed(2333)
-                if passage_num == 0:
-                    query = instance['query']
-                    ans = instance['answer']
-                    docs = []
-                else:
-                    query, ans, docs = processdata(instance, noise_rate, passage_num, args.dataset, args.correct_rate)
-                label,prediction,factlabel = predict(query, ans, docs, model,system,instruction,temperature,args.dataset)
-                instance['label'] = label
-                newinstance = {
+        if args.torch_threads:
+            setthreads(args.torch_threads)
+        model = registry.getmodel(modelname, args)
+        size = devices.footprint(getattr(model, 'model', None))
+        if size is not None:
+            print(f"{modelname} weights: {size / 2**20:.1f} MB on {devices.getdevice()}")
+        if args.draft_plm and not setdraft(model, args.draft_plm):
+            print(f"{modelname} cannot use a draft model")
+        if args.stream and not setstream(model):
+            print(f"{modelname} cannot stream its responses")
+        if policy is not None and not setstopping(model, policy):
+            print(f"{modelname} cannot stop generating early")
+
+    weights = None
+    if pool is not None or size is not None:
+        # device and precision of a local model, which change its responses
+        weights = devices.getdevice(), devices.getprecision(devices.getdevice())
+    batched = args.batch_size > 1 and hasattr(model, 'generate_batch')
+    budget = None
+    if args.truncation != 'none':
+        budget = PromptBudget(model, args.context_length, policy=args.truncation, counts=TokenCounts(args.token_cache))
+    cache = None
+    if args.cache:
+        cache = GenerationCache(args.cache, args.cache_max_entries, args.cache_max_age * 86400 if args.cache_max_age else None)
+        name = f'{modelname}|{args.plm}'
+        if weights is not None:
+            name += '|{}|{}'.format(*weights)
+        if policy is not None:
+            # responses stopped early must not be served to runs without the policy
+            name += f'|stop{policy.name()}'
+        model = CachedModel(model, cache, name)
+
+    timings = timing.fromargs(args)
+    settings = getsettings(args, budget, policy, weights)
+    datasets = {}
+    configs = []
+    for dataset, noise_rate, passage_num, correct_rate in getconfigs(args):
+        if dataset not in datasets:
+            datasets[dataset] = loaddata(dataset)
+        resultpath = getresultpath(dataset, args.factchecking)
+        os.makedirs(resultpath, exist_ok=True)
+        system, instruction = getprompts(dataset, args.factchecking)
+        filename = getfilename(resultpath, dataset, modelname, temperature, noise_rate, passage_num, correct_rate)
+        output = filename
+        positions = list(range(len(datasets[dataset])))
+        if shard is not None:
+            output = getshardname(filename, *shard)
+            ids = datasets[dataset].getids()
+            positions = [i for i in positions if getshard(ids[i], shard[1]) == shard[0]]
+        configs.append({
+            'dataset': dataset,
+            'noise_rate': noise_rate,
+            'passage_num': passage_num,
+            'correct_rate': correct_rate,
+            'system': system,
+            'instruction': instruction,
+            'filename': filename,
+            'output': output,
+            'positions': positions,
+            'journal': PredictionJournal(output + '.json', args.fsync_every, settings),
+            'plan': getplan(datasets[dataset], datasets[dataset].filename, dataset, noise_rate, passage_num, correct_rate, args.plan_seed, args.plan_dir) if args.plan else None,
+        })
+
+    def newrow(job, label, prediction, factlabel):
+        row = {
+            'id': job['id'],
+            'query': job['query'],
+            'ans': job['ans'],
+            'label': label,
+            'prediction': prediction,
+            'docs': job['docs'],
+            'noise_rate': job['config']['noise_rate'],
+            'factlabel': factlabel
+        }
+        if settings:
+            row['settings'] = settings
+        if job['budget'] is not None:
+            row['budget'] = job['budget']
+        if args.stream:
+            row['stats'] = job.get('stats')
+        return row
+
+    def getjobs():
+        for config in configs:
+            journal = config['journal']
+            for position in config['positions']:
+                watch = timings.stopwatch()
+                instance = datasets[config['dataset']][position]
+                if journal.done(instance['id'], instance['query'], instance['answer']):
+                    continue
+                try:
+                    query, ans, docs = preparedata(instance, config['noise_rate'], config['passage_num'], config['dataset'], config['correct_rate'], config['plan'])
+                except Exception as e:
+                    print("Error:", e)
+                    continue
+                watch.lap('processdata')
+                record = None
+                if budget is not None and len(docs) > 0:
+                    docs, record = budget.fit(query, docs, config['instruction'], config['system'])
+                    watch.lap('budget')
+                text, usesystem = getprompt(query, docs, config['instruction'])
+                watch.lap('prompt')
+                yield {
+                    'config': config,
                     'id': instance['id'],
                     'query': query,
                     'ans': ans,
-                    'label': label,
-                    'prediction': prediction,
                     'docs': docs,
-                    'noise_rate': noise_rate,
-                    'factlabel': factlabel
+                    'text': text,
+                    'system': config['system'] if usesystem else None,
+                    'budget': record,
+                    'watch': watch,
                 }
-                results.append(newinstance)
-                f.write(json.dumps(newinstance, ensure_ascii=False)+'\n')
-            except Exception as e:
-                print("Error:", e)
-                continue
-    tt = 0
-    for i in results:
-        label = i['label']
-        if noise_rate == 1 and label[0] == -1:
-            tt += 1
-        elif 0 not in label and 1 in label:
-            tt += 1
-    print("Progress",tt/len(results))
-    accuracy =  (1 - tt/len(results))*100
-    scores = {
-    'all_rate': (tt)/len(results),
-    'model': modelname,
-    'accuracy': accuracy,
-    'noise_rate': noise_rate,
-    'tt':tt,
-    'nums': len(results),
-    }
-    if '_fact' in args.dataset:
-        fact_tt = 0
-        correct_tt = 0
-        for i in results:
-            if i['factlabel'] == 1:
-                fact_tt += 1
-                if 0 not in i['label']:
-                    correct_tt += 1
-        fact_check_rate = fact_tt/len(results)
-        if fact_tt > 0:
-            correct_rate = correct_tt/fact_tt
-        else:
-            correct_rate = 0
-        scores['fact_check_rate'] = fact_check_rate
-        scores['correct_rate'] = correct_rate
-        scores['fact_tt'] = fact_tt
-        scores['correct_tt'] = correct_tt
 
-    
+    def runjob(job):
+        watch = job['watch']
+        # time from the prompt until a generation thread picks the job up
+        watch.lap('queue')
+        try:
+            streaming.clearstats()
+            prediction = generateone(model, job['text'], job['system'], temperature)
+            watch.lap('generate')
+            job['stats'] = streaming.getstats()
+            label,prediction,factlabel = getlabels(prediction, job['ans'], job['config']['dataset'])
+            watch.lap('checkanswer')
+        except CassetteMiss:
+            raise
+        except Exception as e:
+            print("Error:", e)
+            return job, None
+        return job, newrow(job, label, prediction, factlabel)
+
+    def runbatch(jobs):
+        for job in jobs:
+            job['watch'].lap('queue')
+        start = time.perf_counter()
+        try:
+            predictions = predictbatch(jobs, model, temperature, args.batch_size)
+        except CassetteMiss:
+            raise
+        except Exception as e:
+            print("Error:", e)
+            predictions = [None] * len(jobs)
+        # the batch is generated at once, so each job gets an equal share
+        share = (time.perf_counter() - start) / len(jobs)
+        for job, prediction in zip(jobs, predictions):
+            if prediction is None:
+                yield job, None
+                continue
+            watch = job['watch']
+            watch.add('generate', share)
+            watch.restart()
+            label,prediction,factlabel = getlabels(prediction, job['ans'], job['config']['dataset'])
+            watch.lap('checkanswer')
+            yield job, newrow(job, label, prediction, factlabel)
+
+    if batched:
+        generation = runbatches(getjobs(), runbatch, args.batch_size)
+    else:
+        generation = rungeneration(getjobs(), runjob, concurrency)
 
-    json.dump(scores,open(f'{resultpath}/prediction_{args.dataset}_{modelname}_temp{temperature}_noise{noise_rate}_passage{passage_num}_correct{args.correct_rate}_result.json','w'),ensure_ascii=False,indent=4)
+    total = sum(len(config['positions']) for config in configs)
+    initial = sum(len(config['journal']) for config in configs)
+    try:
+        for job, newinstance in tqdm.tqdm(generation, total=total, initial=min(initial, total)):
+            if newinstance is None:
+                continue
+            watch = job['watch']
+            watch.restart()
+            job['config']['journal'].append(newinstance)
+            watch.lap('write')
+            timings.add(job['config']['output'], job['id'], watch)
+    finally:
+        for config in configs:
+            config['journal'].sync()
+    if pool is not None:
+        pool.close()
+    if cache is not None:
+        print("Cache", cache.stats())
+        cache.close()
+    if transport.gettransport().cassette is not None:
+        print("Cassette", transport.gettransport().cassette.stats())
+    assisted = getattr(model, 'assisted', None)
+    if assisted and assisted['drafted']:
+        print(f"Assisted decoding: {assisted['accepted']} of {assisted['drafted']} draft tokens accepted ({assisted['accepted'] / assisted['drafted']:.1%}), {assisted['tokens'] / assisted['seconds']:.1f} tokens/s")
+    if budget is not None:
+        budget.counts.close()
+
+    for config in configs:
+        journal = config['journal']
+        allids = datasets[config['dataset']].getids()
+        ids = [allids[i] for i in config['positions']]
+        if args.compact:
+            journal.compact(ids)
+        results = list(journal.rows(ids))
+        journal.close()
+        if shard is not None:
+            writemanifest(config['output'] + '_manifest.json', {
+                'dataset': config['dataset'],
+                'model': modelname,
+                'plm': args.plm,
+                'temp': temperature,
+                'noise_rate': config['noise_rate'],
+                'passage_num': config['passage_num'],
+                'correct_rate': config['correct_rate'],
+                'factchecking': args.factchecking,
+                'plan': args.plan,
+                'plan_seed': args.plan_seed,
+                'truncation': args.truncation,
+                'context_length': args.context_length,
+                'device': weights and weights[0],
+                'precision': weights and weights[1],
+                'shard': shard[0],
+                'shards': shard[1],
+                'instances': len(allids),
+                'filename': config['filename'],
+                'predictions': config['output'] + '.json',
+                'ids': ids,
+                'positions': config['positions'],
+                'completed': len(results),
+            })
+            print(f"Shard {shard[0]}/{shard[1]}: {len(results)} of {len(ids)} predictions in", config['output'] + '.json')
+            timings.write(config['output'], config['output'] + '_timing.json')
+            continue
+        if len(results) == 0:
+            print("No predictions for", config['filename'])
+            continue
+        start = time.perf_counter()
+        scores = getscores(results, modelname, config['noise_rate'], config['dataset'])
+        timings.addrun(config['output'], 'scoring', time.perf_counter() - start)
+        print("Progress",scores['all_rate'])
+        json.dump(scores,open(config['filename'] + '_result.json','w'),ensure_ascii=False,indent=4)
+        timings.write(config['output'], config['filename'] + '_timing.json')
+    if args.prometheus:
+        timings.writeprometheus(args.prometheus)
@@ -1,7 +1,7 @@
-import requests
+from judge import getdata, judgeall
 
 
-def check(question, answer, url,apikey):
+def check(question, answer, url,apikey, cache=None):
     prompt = '''Please determine whether the model can identify factual errors in the document. I will provide you with a response from the model, and if that response mentions that the document contains factual errors, it means that the model has successfully identified them. Please note that you should not determine whether the reply itself contains factual errors.
 Demonstrations:
 Response:文档信息有误，2008年的奥运会在北京举办。
@@ -23,23 +23,18 @@ Begin to generate:
 Answer: {answer}
     '''
     text2 = prompt.format(answer=answer)
-    return getdata(text2,url,apikey)
+    return getdata(text2,url,apikey,cache)
 
 
-def getdata(text,url,API_KEY):
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "user", "content": text}]
-    }
-    headers={"Authorization": f"Bearer {API_KEY}"}
-    completion = requests.post(url, json=data, headers=headers)
-    completion = completion.json()['choices'][0]['message']['content']
-    return completion
-
 import json
 import tqdm, os
 
 import argparse
+from cache import GenerationCache
+from rescore import readrows
+from models import transport
+import time
+import timing
 
 if __name__ == '__main__':
 
@@ -78,8 +73,45 @@ if __name__ == '__main__':
         '--correct_rate', type=float, default=0.0,
         help='rate of correct passages'
     )
+    parser.add_argument(
+        '--concurrency', type=int, default=1,
+        help='number of judge requests kept in flight'
+    )
+    parser.add_argument(
+        '--pack', type=int, default=1,
+        help='number of responses judged in one request'
+    )
+    parser.add_argument(
+        '--fastpath', action='store_true',
+        help='decide responses with canned phrases locally and only judge the others'
+    )
+    parser.add_argument(
+        '--calibrate', type=int, default=0,
+        help='number of fast-path responses also sent to the judge to measure agreement'
+    )
+    parser.add_argument(
+        '--cache', type=str, default=None,
+        help='path of the sqlite generation cache, disabled if not given'
+    )
+    parser.add_argument(
+        '--cache_max_entries', type=int, default=None,
+        help='maximum number of cached generations'
+    )
+    parser.add_argument(
+        '--cache_max_age', type=float, default=None,
+        help='maximum age of cached generations in days'
+    )
+
+    transport.addarguments(parser)
+    timing.addarguments(parser)
 
     args = parser.parse_args()
+    timings = timing.fromargs(args)
+    transport.configurefromargs(args, args.concurrency)
+
+    cache = None
+    if args.cache:
+        cache = GenerationCache(args.cache, args.cache_max_entries, args.cache_max_age * 86400 if args.cache_max_age else None)
 
     if 'en' in args.dataset:
         resultpath = 'result-en'
@@ -104,27 +136,42 @@ if __name__ == '__main__':
     
 
 
+    def used(data):
+        # a verdict only holds for the prediction it judged
+        return data['id'] in useddata and data['prediction'] == useddata[data['id']].get('prediction')
+
+    # the prediction file is a journal: keep the newest row of every id
+    rows = readrows(evaluefile)
+    todo = [(data['query'], data['prediction']) for data in rows if not used(data)]
+    judgestats = {}
+    evaluations = judgeall('fact', todo, check, args.url, args.api_key, cache, args.concurrency, args.pack, args.fastpath, args.calibrate, judgestats)
+
     with open(outputfile,'w',encoding='utf-8') as f:
-        with open(evaluefile, 'r', encoding='utf-8') as f2:
-            for line in tqdm.tqdm(f2):
-                data = json.loads(line)
-                if data['id'] in useddata:
-                    results.append(useddata[data['id']])
-                    f.write(json.dumps(useddata[data['id']],ensure_ascii=False)+'\n')
-                    continue
-                try:
-                    question = data['query']
-                    answer = data['prediction']
-                    
-                    evaluation = check(question, answer, args.url, args.api_key)
-                    data['evaluation'] = evaluation
-                    results.append(data)
-                    f.write(json.dumps(data,ensure_ascii=False)+'\n')
-                except Exception as e:
-                    print(e)
-                    print(question,answer)
-                    continue
+        for data in tqdm.tqdm(rows):
+            if used(data):
+                results.append(useddata[data['id']])
+                f.write(json.dumps(useddata[data['id']],ensure_ascii=False)+'\n')
+                continue
+            watch = timings.stopwatch()
+            # with --concurrency > 1 this is the wait for the next verdict in order
+            evaluation = next(evaluations)
+            watch.lap('judge')
+            if evaluation is None:
+                continue
+            data['evaluation'] = evaluation
+            results.append(data)
+            f.write(json.dumps(data,ensure_ascii=False)+'\n')
+            watch.lap('write')
+            timings.add(outputfile, data['id'], watch)
+    if args.fastpath:
+        print(f"Fast path decided {judgestats['fastpath']} of {judgestats['items']} responses, agreed with the judge on {judgestats['agreed']} of {judgestats['calibrated']} calibration samples")
+    if cache is not None:
+        print("Cache", cache.stats())
+        cache.close()
+    if transport.gettransport().cassette is not None:
+        print("Cassette", transport.gettransport().cassette.stats())
     
+    start = time.perf_counter()
     rejecttt = 0
     tt = 0
     correct_tt = 0
@@ -146,4 +193,8 @@ if __name__ == '__main__':
         'nums': len(results),
         'noise_rate': args.noise_rate,
     }
-    json.dump(scores, open(resultfile, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
\ No newline at end of file
+    json.dump(scores, open(resultfile, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+    timings.addrun(outputfile, 'scoring', time.perf_counter() - start)
+    timings.write(outputfile, outputfile[:-len('.json')] + '_timing.json')
+    if args.prometheus:
+        timings.writeprometheus(args.prometheus)
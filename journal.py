@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+
+
+def getdigest(query, ans, settings=None):
+    # rows of the default settings keep the digest they had before settings existed
+    data = json.dumps([query, ans] if settings is None else [query, ans, settings], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+
+class PredictionJournal:
+    '''
+    Append-only prediction file with a compact index of completed ids.
+
+    Rows are only ever appended to `filename`, and every row gets a line
+    [id, offset, length, digest] in `filename + '.idx'`, where digest is a
+    hash of the row's query and answer, and of its 'settings' if it has
+    any (the generation settings that do not show in the filename, such as
+    a doc sampling plan). Both files are fsynced every
+    `fsync_every` rows. On open the index is read instead of the rows, and
+    only the part of the prediction file past the last indexed row is
+    scanned, so resuming does not depend on the number of completed rows.
+    A partial last line left by a crash is cut off.
+
+    Rows for an id that is written again (e.g. because its query or the
+    settings changed) are superseded by the newest row.
+    '''
+
+    def __init__(self, filename, fsync_every=32, settings=None):
+        self.filename = filename
+        self.settings = settings or None
+        self.indexfile = filename + '.idx'
+        self.fsync_every = fsync_every
+        self.index = {}
+        self.pending = 0
+        end = self._loadindex()
+        self._recover(end)
+        self.f = open(self.filename, 'ab')
+        self.fidx = open(self.indexfile, 'a', encoding='utf-8')
+
+    def _loadindex(self):
+        if not os.path.exists(self.filename):
+            if os.path.exists(self.indexfile):
+                os.remove(self.indexfile)
+            return 0
+        if not os.path.exists(self.indexfile):
+            return 0
+        size = os.path.getsize(self.filename)
+        end = 0
+        last = None
+        with open(self.indexfile, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    id, offset, length, digest = json.loads(line)
+                except ValueError:
+                    continue
+                if offset + length > size:
+                    continue
+                self.index[id] = (offset, length, digest)
+                if offset + length > end:
+                    end = offset + length
+                    last = id
+        if last is not None:
+            row = self._readat(*self.index[last][:2])
+            if row is None or row.get('id') != last:
+                # the prediction file does not match its index, rebuild it
+                self.index = {}
+                os.remove(self.indexfile)
+                return 0
+        return end
+
+    def _recover(self, end):
+        if not os.path.exists(self.filename):
+            return
+        entries = []
+        with open(self.filename, 'rb+') as f:
+            f.seek(end)
+            offset = end
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    break
+                entries.append((row['id'], offset, len(line), getdigest(row['query'], row['ans'], row.get('settings'))))
+                offset += len(line)
+            f.truncate(offset)
+        if entries:
+            with open(self.indexfile, 'a', encoding='utf-8') as f:
+                for entry in entries:
+                    self.index[entry[0]] = entry[1:]
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def _readat(self, offset, length):
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            try:
+                return json.loads(f.read(length))
+            except ValueError:
+                return None
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def done(self, id, query, ans):
+        return id in self.index and self.index[id][2] == getdigest(query, ans, self.settings)
+
+    def append(self, row):
+        line = (json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8')
+        offset = self.f.tell()
+        self.f.write(line)
+        entry = (row['id'], offset, len(line), getdigest(row['query'], row['ans'], row.get('settings')))
+        self.fidx.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.index[row['id']] = entry[1:]
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def read(self, id):
+        offset, length, _ = self.index[id]
+        self.f.flush()
+        return self._readat(offset, length)
+
+    def rows(self, ids):
+        '''Yield the newest row of every id in `ids` that has one, in that order.'''
+        self.f.flush()
+        with open(self.filename, 'rb') as f:
+            for id in ids:
+                if id not in self.index:
+                    continue
+                offset, length, _ = self.index[id]
+                f.seek(offset)
+                yield json.loads(f.read(length))
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.fidx.flush()
+        os.fsync(self.fidx.fileno())
+        self.pending = 0
+
+    def compact(self, ids):
+        '''Rewrite the prediction file with one row per id, in the order of `ids`.'''
+        self.sync()
+        tmpfile = self.filename + '.tmp'
+        entries = []
+        with open(tmpfile, 'wb') as f:
+            for row in self.rows(ids):
+                line = (json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8')
+                entries.append((row['id'], f.tell(), len(line), getdigest(row['query'], row['ans'], row.get('settings'))))
+                f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.f.close()
+        self.fidx.close()
+        os.replace(tmpfile, self.filename)
+        with open(self.indexfile + '.tmp', 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(self.indexfile + '.tmp', self.indexfile)
+        self.index = {entry[0]: entry[1:] for entry in entries}
+        self.f = open(self.filename, 'ab')
+        self.fidx = open(self.indexfile, 'a', encoding='utf-8')
+
+    def close(self):
+        self.sync()
+        self.f.close()
+        self.fidx.close()
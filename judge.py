@@ -0,0 +1,233 @@
+import json
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from models.cassette import CassetteMiss
+from models.transport import gettransport
+
+
+def getdata(text,url,API_KEY,cache=None):
+    data = {
+        "model": "gpt-3.5-turbo",
+        "messages": [{"role": "user", "content": text}]
+    }
+    if cache is not None:
+        key = cache.key(data['model'], None, text)
+        completion = cache.get(key)
+        if completion is not None:
+            return completion
+    headers={"Authorization": f"Bearer {API_KEY}"}
+    completion = gettransport().post(url, json=data, headers=headers)
+    completion = completion.json()['choices'][0]['message']['content']
+    if cache is not None:
+        cache.put(key, completion)
+    return completion
+
+
+# Packed prompts judge several responses in one request. The verdicts are
+# mapped back to the sentences of the single-item prompts, so the scoring in
+# reject_evalue.py and fact_evalue.py is unchanged.
+PACKED = {
+    'reject': {
+        'prompt': '''I will give you several questions, each with an answer generated through document retrieval. For every item, use the answer to determine if the retrieved document can solve the question.
+Demonstrations:
+Question: 2023年澳网女单冠军是谁
+Answer:文档信息不足，因此我无法基于提供的文档回答该问题。
+Verdict: no
+
+Question: Who is the champion of Australian Open 2023 Women's Singles?
+Answer: Serena Williams
+Verdict: yes
+
+Question: Where is ACL2023 held?
+Answer: Location of ACL2023 has not been confirmed.
+Verdict: no
+
+Question:  2023年中国GDP是多少?
+Answer: I can not answer this question。
+Verdict: no
+
+Reply with only a JSON list containing one object per item, such as [{{"id": 1, "verdict": "yes"}}], where "yes" means the question is addressed by the documents and "no" means it is not.
+Begin to generate:
+{ITEMS}
+''',
+        'item': '''[{ID}]
+Question: {question}
+Answer: {answer}
+''',
+        'yes': 'Yes, the question is addressed by the documents.',
+        'no': 'No, the question is not addressed by the documents.',
+    },
+    'fact': {
+        'prompt': '''Please determine whether the model can identify factual errors in the document. I will provide you with several responses from the model, and if a response mentions that the document contains factual errors, it means that the model has successfully identified them. Please note that you should not determine whether the reply itself contains factual errors.
+Demonstrations:
+Response:文档信息有误，2008年的奥运会在北京举办。
+Verdict: yes
+
+Response:2014年澳网女单冠军是大阪直美。
+Verdict: no
+
+Response: The director of the Silent Hill movie is Justin Kurzel.
+Verdict: no
+
+Response: Harry Potter is written by J. K. Rowling.
+Verdict: no
+
+Response:  There are factual errors in the provided documents. The correct answer is 2023.
+Verdict: yes
+
+Reply with only a JSON list containing one object per item, such as [{{"id": 1, "verdict": "yes"}}], where "yes" means the model has identified the factual errors and "no" means it failed to.
+Begin to generate:
+{ITEMS}
+''',
+        'item': '''[{ID}]
+Response: {answer}
+''',
+        'yes': 'Yes, the model has identified the factual errors.',
+        'no': 'NO, the model fail to identify the factual errors.',
+    },
+}
+
+
+# Canned responses asked for by config/instruction.yaml. A response that
+# contains one of them has an obvious verdict, which prejudge() returns
+# without calling the judge.
+CANNED = {
+    'reject': (['信息不足', 'insufficient information'], 'no'),
+    'fact': (['事实性错误', 'factual errors'], 'yes'),
+}
+
+
+def prejudge(kind, answer):
+    phrases, verdict = CANNED[kind]
+    for phrase in phrases:
+        if phrase in answer:
+            return PACKED[kind][verdict]
+    return None
+
+
+def getverdict(kind, evaluation):
+    '''Read a judge evaluation the way reject_evalue.py and fact_evalue.py score it.'''
+    if kind == 'reject':
+        return 'no' if "not addressed" in evaluation else 'yes'
+    return 'yes' if "has identified" in evaluation or "Yes" in evaluation else 'no'
+
+
+def packprompt(kind, items):
+    packed = PACKED[kind]
+    texts = [packed['item'].format(ID=i + 1, question=question, answer=answer) for i, (question, answer) in enumerate(items)]
+    return packed['prompt'].format(ITEMS='\n'.join(texts))
+
+
+def parseverdicts(kind, text, num):
+    '''
+    Parse the reply to a packed prompt into one evaluation sentence per item,
+    or return None if the reply does not have a yes/no verdict for every item.
+    '''
+    start, end = text.find('['), text.rfind(']')
+    if start < 0 or end < start:
+        return None
+    try:
+        verdicts = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(verdicts, list):
+        return None
+    evaluations = {}
+    for verdict in verdicts:
+        if not isinstance(verdict, dict):
+            return None
+        id, value = verdict.get('id'), str(verdict.get('verdict', '')).strip().lower()
+        if not isinstance(id, int) or not 1 <= id <= num or value not in ('yes', 'no'):
+            return None
+        evaluations[id] = PACKED[kind][value]
+    if len(evaluations) != num:
+        return None
+    return [evaluations[i + 1] for i in range(num)]
+
+
+def judgeall(kind, items, check, url, apikey, cache=None, concurrency=1, pack=1, fastpath=False, calibrate=0, stats=None):
+    '''
+    Judge a list of (question, answer) items and yield one evaluation per
+    item, in order (None where the judge call failed).
+
+    With pack > 1 every request carries up to `pack` items and asks for
+    structured per-item verdicts; a pack whose reply cannot be parsed falls
+    back to one check() call per item. Up to `concurrency` requests are in
+    flight at a time.
+
+    With fastpath=True, responses that contain a canned phrase are decided
+    by prejudge() and only the others are sent to the judge. `calibrate`
+    of the fast-path items (a fixed random sample) are judged anyway and
+    compared with the rule. The counts go into the `stats` dict.
+    '''
+    items = list(items)
+    local = [prejudge(kind, answer) if fastpath else None for _, answer in items]
+    fired = [i for i, evaluation in enumerate(local) if evaluation is not None]
+    sample = set(random.Random(0).sample(fired, min(calibrate, len(fired))))
+    judged = [i for i, evaluation in enumerate(local) if evaluation is None or i in sample]
+    if stats is not None:
+        stats.update({'items': len(items), 'fastpath': len(fired), 'judged': len(judged), 'calibrated': 0, 'agreed': 0})
+
+    evaluations = judgeitems(kind, [items[i] for i in judged], check, url, apikey, cache, concurrency, pack)
+    for i in range(len(items)):
+        if local[i] is None:
+            yield next(evaluations)
+            continue
+        if i in sample:
+            evaluation = next(evaluations)
+            if evaluation is not None and stats is not None:
+                stats['calibrated'] += 1
+                stats['agreed'] += int(getverdict(kind, evaluation) == getverdict(kind, local[i]))
+        yield local[i]
+
+
+def judgeitems(kind, items, check, url, apikey, cache=None, concurrency=1, pack=1):
+    '''Send (question, answer) items to the judge and yield their evaluations in order.'''
+    def single(item):
+        try:
+            return check(item[0], item[1], url, apikey, cache)
+        except CassetteMiss:
+            raise
+        except Exception as e:
+            print(e)
+            print(item[0], item[1])
+            return None
+
+    def packed(chunk):
+        if len(chunk) == 1:
+            return [single(chunk[0])]
+        try:
+            evaluations = parseverdicts(kind, getdata(packprompt(kind, chunk), url, apikey, cache), len(chunk))
+        except CassetteMiss:
+            raise
+        except Exception as e:
+            print(e)
+            evaluations = None
+        if evaluations is None:
+            evaluations = [single(item) for item in chunk]
+        return evaluations
+
+    def chunks():
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= pack:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    if concurrency <= 1:
+        for chunk in chunks():
+            yield from packed(chunk)
+        return
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for chunk in chunks():
+            pending.append(executor.submit(packed, chunk))
+            if len(pending) >= concurrency * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
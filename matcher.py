@@ -0,0 +1,129 @@
+import json
+import unicodedata
+
+
+def normalize(text):
+    '''Lowercase and fold full-width forms (NFKC), e.g. "ＡＢＣ１２３" -> "abc123".'''
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+class Automaton:
+    '''
+    Aho-Corasick automaton over a list of patterns. search() returns the ids
+    of all patterns that occur in a text, in one pass over the text.
+    '''
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.always = []
+        for pid, pattern in enumerate(patterns):
+            if len(pattern) == 0:
+                self.always.append(pid)
+                continue
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(pid)
+
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and char not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(char, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def search(self, text):
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set(self.always)
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+class AnswerMatcher:
+    '''
+    Precompiled checkanswer() for one or more ground truths.
+
+    The aliases of every ground truth are folded once when the matcher is
+    built, so scoring a prediction only folds the prediction. Ground truths
+    with more than `threshold` distinct aliases are compiled into an
+    Aho-Corasick automaton and scanned in a single pass; below that C
+    substring search over the few aliases is faster than a Python automaton.
+    labels(prediction, k) gives the same result as
+    checkanswer(prediction, ground_truths[k]). With normalize=True both sides
+    are NFKC-folded, which makes full-width and half-width forms match (meant
+    for the zh datasets).
+    '''
+
+    def __init__(self, ground_truths, normalize=False, threshold=32):
+        self.normalize = normalize
+        self.groups = []
+        self.automata = []
+        for ground_truth in ground_truths:
+            if type(ground_truth) is not list:
+                ground_truth = [ground_truth]
+            groups = []
+            for instance in ground_truth:
+                aliases = instance if type(instance) == list else [instance]
+                groups.append(tuple(dict.fromkeys(self._fold(alias) for alias in aliases)))
+            patterns = list(dict.fromkeys(alias for group in groups for alias in group))
+            if len(patterns) > threshold:
+                pids = {alias: pid for pid, alias in enumerate(patterns)}
+                self.groups.append([{pids[alias] for alias in group} for group in groups])
+                self.automata.append(Automaton(patterns))
+            else:
+                self.groups.append(groups)
+                self.automata.append(None)
+
+    def _fold(self, text):
+        return normalize(text) if self.normalize else text.lower()
+
+    def labels(self, prediction, k=0):
+        prediction = self._fold(prediction)
+        automaton = self.automata[k]
+        if automaton is not None:
+            found = automaton.search(prediction)
+            return [int(len(pids & found) > 0) for pids in self.groups[k]]
+        labels = []
+        for group in self.groups[k]:
+            flag = 0
+            for alias in group:
+                if alias in prediction:
+                    flag = 1
+                    break
+            labels.append(flag)
+        return labels
+
+    def batch(self, predictions, ks=None):
+        if ks is None:
+            ks = range(len(predictions))
+        return [self.labels(prediction, k) for prediction, k in zip(predictions, ks)]
+
+
+_matchers = {}
+
+
+def getmatcher(ground_truth, normalize=False, maxsize=4096):
+    '''Cached AnswerMatcher for a single ground truth.'''
+    key = (json.dumps(ground_truth, ensure_ascii=False), normalize)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        if len(_matchers) >= maxsize:
+            _matchers.clear()
+        matcher = _matchers[key] = AnswerMatcher([ground_truth], normalize)
+    return matcher
@@ -0,0 +1,118 @@
+import argparse
+import glob
+import json
+import os
+import sys
+
+from rescore import readrows
+from scoring import getscores
+from shards import CONFIGFIELDS, readmanifest
+
+
+def checkgroup(manifests, allow_missing=False):
+    '''
+    Problems that prevent merging the shard manifests of one prediction
+    file, and the rows of every instance by dataset position. With
+    allow_missing=True instances without a prediction (e.g. those whose
+    docs cannot be sampled, which evalue.py skips) are left out instead.
+    '''
+    problems = []
+    first = manifests[0]
+    for manifest in manifests[1:]:
+        for field in CONFIGFIELDS:
+            if manifest.get(field) != first.get(field):
+                problems.append(f"shard {manifest['shard']} has {field}={manifest.get(field)!r}, shard {first['shard']} has {first.get(field)!r}")
+    if problems:
+        return problems, None
+
+    count = first['shards']
+    shards = sorted(manifest['shard'] for manifest in manifests)
+    missing = sorted(set(range(count)) - set(shards))
+    if missing:
+        problems.append(f"missing shards {', '.join(map(str, missing))} of {count}")
+    if len(shards) != len(set(shards)):
+        problems.append('duplicate shard manifests')
+
+    rows = {}
+    covered = set()
+    for manifest in manifests:
+        predictions = {row['id']: row for row in readrows(manifest['predictions'])} if os.path.exists(manifest['predictions']) else {}
+        absent = 0
+        for id, position in zip(manifest['ids'], manifest['positions']):
+            if position in covered:
+                problems.append(f"instance {id} is in more than one shard")
+            covered.add(position)
+            if id not in predictions:
+                absent += 1
+                continue
+            rows[position] = predictions[id]
+        if absent and not allow_missing:
+            problems.append(f"shard {manifest['shard']} is missing {absent} of {len(manifest['ids'])} predictions")
+    if not missing and len(covered) != first['instances']:
+        problems.append(f"the shards cover {len(covered)} of {first['instances']} instances")
+    return problems, rows
+
+
+def merge(manifests, allow_missing=False):
+    first = manifests[0]
+    problems, rows = checkgroup(manifests, allow_missing)
+    if problems:
+        return problems
+    results = [rows[position] for position in sorted(rows)]
+    if len(results) == 0:
+        return ['no predictions']
+    filename = first['filename']
+    with open(filename + '.json.tmp', 'w', encoding='utf-8') as f:
+        for row in results:
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+    os.replace(filename + '.json.tmp', filename + '.json')
+    if os.path.exists(filename + '.json.idx'):
+        # the index of an earlier unsharded run no longer matches the file
+        os.remove(filename + '.json.idx')
+    scores = getscores(results, first['model'], first['noise_rate'], first['dataset'])
+    json.dump(scores, open(filename + '_result.json', 'w'), ensure_ascii=False, indent=4)
+    print(f"Merged {len(manifests)} shards ({len(results)} of {first['instances']} predictions) into {filename}.json, all_rate {scores['all_rate']}")
+    return []
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='merge the shards of evalue.py --shard runs into the prediction and _result.json files')
+
+    parser.add_argument(
+        'patterns', type=str, nargs='*', default=['result-en/**/*_manifest.json', 'result-zh/**/*_manifest.json'],
+        help='glob patterns of shard manifests'
+    )
+    parser.add_argument(
+        '--check', action='store_true',
+        help='only check the shards for completeness and consistency'
+    )
+    parser.add_argument(
+        '--allow_missing', action='store_true',
+        help='merge even if some instances have no prediction'
+    )
+
+    args = parser.parse_args()
+
+    groups = {}
+    for path in sorted({f for pattern in args.patterns for f in glob.glob(pattern, recursive=True)}):
+        manifest = readmanifest(path)
+        groups.setdefault(manifest['filename'], []).append(manifest)
+    if not groups:
+        print('No shard manifests found')
+        sys.exit(1)
+
+    failed = False
+    for filename, manifests in groups.items():
+        if args.check:
+            problems, _ = checkgroup(manifests, args.allow_missing)
+        else:
+            problems = merge(manifests, args.allow_missing)
+        if problems:
+            failed = True
+            print(f'Cannot merge {filename}:')
+            for problem in problems:
+                print('   ', problem)
+        elif args.check:
+            print(f'{filename}: {len(manifests)} shards complete')
+    sys.exit(1 if failed else 0)
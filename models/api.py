@@ -0,0 +1,163 @@
+import warnings
+
+import requests
+import urllib3
+
+from models.streaming import chat
+
+# Suppress SSL warnings
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+warnings.simplefilter("ignore", category=urllib3.exceptions.InsecureRequestWarning)
+
+
+class OpenAIAPIModel():
+    context_length = 16385
+    stream = False
+    stopping = None
+
+    def __init__(self, api_key, url="https://api.openai.com/v1/completions", model="gpt-3.5-turbo"):
+        self.url = url
+        self.model = model
+        self.API_KEY = api_key
+
+    def generate(self, text: str, temperature=0.7, system="You are a helpful assistant. You can help me by answering my questions. You can also ask me questions.", top_p=1):
+        headers={"Authorization": f"Bearer {self.API_KEY}"}
+
+        query = {
+            "model": self.model,
+            "temperature": temperature,
+            "top_p": top_p,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system,
+                },
+                {
+                    "role": "user",
+                    "content": text,
+                }
+            ],
+            "stream": False
+        }
+        responses, content = chat(self.url, headers, query, self.stream, stopping=self.stopping)
+        if content is None:
+            print(text)
+            print(responses)
+            raise ValueError(f'no choices in the response: {responses.text}')
+        return content
+
+
+class Llama3Model:
+    context_length = 8192
+    stream = False
+    stopping = None
+
+    def __init__(self, api_key= "", model="llama3-70b-8192", url="https://api.groq.com/openai/v1/chat/completions"):
+        self.api_key =api_key
+        self.model = model
+        #self.api_url = "https://api.groq.com/v1/chat/completions"
+        self.api_url = url
+
+    def generate(self, text, temperature=0.7, top_p=0.8, max_new_tokens=256):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+
+        }
+
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": "You are a helpful AI assistant."},
+                {"role": "user", "content": text}
+            ],
+            "temperature": temperature,
+            "top_p": 0.8,
+            "max_tokens": max_new_tokens
+        }
+
+        response, content = chat(self.api_url, headers, payload, self.stream, verify=False, stopping=self.stopping)
+        if content is not None:
+            return content
+        else:
+            return f"Error: {response.json()}"
+
+
+class QwenChat:
+    context_length = 32768
+    stream = False
+    stopping = None
+
+    def __init__(self, api_key="", model="Qwen2.5-72B-Instruct"):
+        self.api_key = api_key 
+        if not self.api_key:
+            raise ValueError("API key must be provided either as an argument or via the SAMBANNOVA_API_KEY environment variable.")
+        
+        self.model = model
+        self.api_url = "https://api.sambanova.ai/v1/chat/completions"  # Ensure correct endpoint
+
+    def generate(self, text, temperature=0.7, top_p=0.8, max_new_tokens=256, stream=False):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": "You are a helpful AI assistant."},
+                {"role": "user", "content": text}
+            ],
+            "temperature": temperature,
+            "top_p": 0.8,
+            "max_tokens": max_new_tokens,
+            "stream": False
+        }
+
+        try:
+            response, content = chat(self.api_url, headers, payload, stream or self.stream, verify=False, stopping=self.stopping)
+            response.raise_for_status()  # Raise error for HTTP failures
+            return content or "No response received."
+
+        except requests.exceptions.HTTPError as e:
+            print(f"HTTP Error: {e}")
+            print(f"Response Body: {response.text}")
+            return f"Request failed: {e}"
+        except requests.exceptions.RequestException as e:
+            return f"Request failed: {e}"
+
+
+class QwenGroq:
+    context_length = 32768
+    stream = False
+    stopping = None
+
+    def __init__(self, api_key= "", model="qwen-2.5-32b", url="https://api.groq.com/openai/v1/chat/completions"):
+        self.api_key =api_key
+        self.model = model
+        #self.api_url = "https://api.groq.com/v1/chat/completions"
+        self.api_url = url
+
+    def generate(self, text, temperature=0.7, top_p=0.8, max_new_tokens=128):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+
+        }
+
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": "You are a helpful AI assistant."},
+                {"role": "user", "content": text}
+            ],
+            "temperature": temperature,
+            "top_p": 0.95,
+            "max_tokens": max_new_tokens
+        }
+
+        response, content = chat(self.api_url, headers, payload, self.stream, verify=False, stopping=self.stopping)
+        if content is not None:
+            return content
+        else:
+            return f"Error: {response.json()}"
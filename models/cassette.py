@@ -0,0 +1,159 @@
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class CassetteMiss(KeyError):
+    '''A request that is not in the cassette being replayed.'''
+
+    def __str__(self):
+        return self.args[0]
+
+
+class Cassette:
+    '''
+    Recorded request/response pairs of the API transport, for re-running an
+    evaluation offline and deterministically.
+
+    In record mode every response returned by the transport is appended to
+    the cassette, one JSON line per request, gzip-compressed if the path ends
+    in .gz. Requests are keyed by a hash of the URL and the JSON body;
+    headers (which hold the API keys) are never recorded. In replay mode the
+    responses are served from memory without touching the network or the
+    rate limiter, and a request that was not recorded raises CassetteMiss.
+    A request that was recorded several times (e.g. sampled again at the
+    same temperature) replays its responses in the recorded order and then
+    repeats the last one.
+
+    A streamed response is recorded as the caller reads it, so it arrives
+    at its own pace, and a stream the caller closes early is recorded up to
+    that point.
+    '''
+
+    def __init__(self, path, mode):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'cassette mode must be record or replay, not {mode!r}')
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.served = {}
+        self.hits = 0
+        self.recorded = 0
+        if os.path.exists(path):
+            self.load()
+        elif mode == 'replay':
+            raise FileNotFoundError(f'cassette {path} does not exist')
+        self.file = None
+        if mode == 'record':
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = self.open('at')
+            # a gzip cassette is only complete once its trailer is written
+            atexit.register(self.close)
+
+    def open(self, mode):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode, encoding='utf-8')
+        return open(self.path, mode, encoding='utf-8')
+
+    def load(self):
+        with self.open('rt') as f:
+            try:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short by an interrupted recording
+                        continue
+                    self.entries.setdefault(entry['key'], []).append(entry)
+            except EOFError:
+                # a gzip cassette whose recording was killed before closing
+                pass
+
+    @staticmethod
+    def key(url, payload):
+        data = json.dumps([url, payload], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def replay(self, url, payload):
+        key = self.key(url, payload)
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                raise CassetteMiss(f'request to {url} is not in cassette {self.path} (key {key[:12]}, {len(self.entries)} recorded requests)')
+            index = self.served.get(key, 0)
+            self.served[key] = index + 1
+            self.hits += 1
+        entry = entries[min(index, len(entries) - 1)]
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = entry['body'].encode('utf-8')
+        response._content_consumed = True
+        response.encoding = 'utf-8'
+        response.url = url
+        return response
+
+    def record(self, url, payload, response, stream=False):
+        '''Record a response; a streamed one is recorded once the caller has read or closed it.'''
+        if not stream or response.status_code != 200:
+            self.write(url, payload, response, response.content)
+            return
+        chunks = []
+        done = []
+        iter_content = response.iter_content
+        close = response.close
+
+        def finish():
+            if not done:
+                done.append(True)
+                self.write(url, payload, response, b''.join(chunks))
+
+        def tee(*args, **kwargs):
+            try:
+                for chunk in iter_content(*args, **kwargs):
+                    chunks.append(chunk)
+                    yield chunk
+            finally:
+                finish()
+
+        def closeandfinish():
+            close()
+            finish()
+
+        response.iter_content = tee
+        response.close = closeandfinish
+
+    def write(self, url, payload, response, body):
+        entry = {
+            'key': self.key(url, payload),
+            'url': url,
+            'status': response.status_code,
+            'headers': {'Content-Type': response.headers.get('Content-Type', 'application/json')},
+            # JSON and event-stream bodies are UTF-8 even when the headers name no charset
+            'body': body.decode('utf-8', errors='replace'),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.entries.setdefault(entry['key'], []).append(entry)
+            if self.file is None:
+                # a stream finished after the cassette was closed
+                return
+            self.file.write(line)
+            self.file.flush()
+            self.recorded += 1
+
+    def stats(self):
+        return {'mode': self.mode, 'requests': len(self.entries), 'hits': self.hits, 'recorded': self.recorded}
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
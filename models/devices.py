@@ -0,0 +1,104 @@
+import sys
+import warnings
+
+
+PRECISIONS = ['auto', 'fp32', 'fp16', 'bf16', 'int8']
+
+_device = 'auto'
+_precision = 'auto'
+
+
+def configure(device='auto', precision='auto'):
+    '''Choose the device and precision every local model is loaded with, before it is created.'''
+    global _device, _precision
+    if precision not in PRECISIONS:
+        raise ValueError(f'precision must be one of {", ".join(PRECISIONS)}, not {precision!r}')
+    _device = device
+    _precision = precision
+
+
+def getdevice(device=None):
+    device = device or _device
+    if device == 'auto':
+        import torch
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    return device
+
+
+def getprecision(device, precision=None):
+    '''The configured precision, with auto resolved to fp16 on GPUs and fp32 on the CPU.'''
+    precision = precision or _precision
+    if precision == 'auto':
+        return 'fp32' if device == 'cpu' else 'fp16'
+    return precision
+
+
+def loadmodel(cls, plm, precision=None, **kwargs):
+    '''
+    Load a model with cls.from_pretrained(plm, **kwargs) on the configured
+    device and in the configured (or the given) precision.
+
+    bf16 and fp16 load the weights in that dtype. int8 loads them in fp32
+    and then quantizes the Linear layers dynamically (int8 weights,
+    activations quantized on the fly) on the CPU; on a GPU it loads them
+    8-bit with bitsandbytes.
+    '''
+    import torch
+    device = getdevice()
+    precision = getprecision(device, precision)
+    dtypes = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16, 'int8': torch.float32}
+    kwargs['dtype'] = dtypes[precision]
+    if precision == 'int8' and device != 'cpu':
+        from transformers import BitsAndBytesConfig
+        kwargs['quantization_config'] = BitsAndBytesConfig(load_in_8bit=True)
+        kwargs['device_map'] = 'auto'
+        return cls.from_pretrained(plm, **kwargs).eval()
+    if device == 'cuda':
+        # spread models larger than one GPU over the GPUs
+        kwargs['device_map'] = 'auto'
+        return cls.from_pretrained(plm, **kwargs).eval()
+    model = cls.from_pretrained(plm, **kwargs).to(device).eval()
+    if precision == 'int8':
+        model = quantize(model)
+    return model
+
+
+def quantize(model):
+    '''Dynamic int8 quantization of the Linear layers of a CPU model.'''
+    import torch
+    with warnings.catch_warnings():
+        # the eager-mode quantization API is deprecated in favour of torchao
+        warnings.simplefilter('ignore')
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def footprint(model):
+    '''Bytes of the weights and buffers of a torch model (packed int8 weights included), None for other models.'''
+    if 'torch' not in sys.modules:
+        return None
+    import torch
+    if not isinstance(model, torch.nn.Module):
+        return None
+    total = 0
+    for value in model.state_dict().values():
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.nelement() * tensor.element_size()
+    return total
+
+
+def addarguments(parser):
+    '''Add the device options to an argparse parser.'''
+    parser.add_argument(
+        '--device', type=str, default='auto',
+        help='device of local models (cpu, cuda, cuda:1, ...), the GPU if there is one if auto'
+    )
+    parser.add_argument(
+        '--precision', type=str, default='auto',
+        help='weights of local models: fp16 on GPUs and fp32 on the CPU if auto, bf16, or int8 (dynamic quantization on the CPU)',
+        choices=PRECISIONS
+    )
+
+
+def configurefromargs(args):
+    configure(args.device, args.precision)
@@ -0,0 +1,48 @@
+import time
+
+from google import genai
+from google.genai import types
+
+from models.streaming import clearstats, makestats, setstats
+
+
+class GeminiModel:
+    context_length = 1048576
+
+    def __init__(self, model: str = "gemini-2.0-flash"):
+        self.client = genai.Client(api_key="")
+        self.model = model
+
+    def generate(self, prompt: str, *args, **kwargs):
+        """Generate content based on the given prompt."""
+        clearstats()
+        try:
+            start = time.perf_counter()
+            response = self.client.models.generate_content(
+                    model="gemini-2.0-flash",
+                    contents=[prompt],
+                    config=types.GenerateContentConfig(
+                        max_output_tokens=500,
+                        temperature=0.1,
+                        candidate_count=5,
+                        top_k=5,
+                        top_p=1
+                    )
+                )
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                # not streamed: the five candidates would arrive interleaved
+                setstats(makestats(start, None, time.perf_counter(), usage.prompt_token_count, usage.candidates_token_count, 'usage'))
+           # Extract response text properly from Candidate objects
+            full_response = ""
+            if hasattr(response, "candidates"):
+                for candidate in response.candidates:
+                    if hasattr(candidate, "content") and candidate.content.parts:
+                        for part in candidate.content.parts:
+                            if hasattr(part, "text"):
+                                full_response += part.text + "\n"  # Append text response
+
+            return full_response.strip() if full_response else "Error: No valid response received."
+
+        except Exception as e:
+            return f"Error: {e}"
@@ -0,0 +1,185 @@
+import random
+import re
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+
+def parseduration(value):
+    '''
+    Parse the durations used in rate-limit headers into seconds, e.g.
+    "20", "1.5", "6ms", "2m59.56s" or "1h2m".
+    '''
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'([\d.]+)\s*(ms|h|m|s)', value)
+    if not parts:
+        return None
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def retryafter(headers):
+    '''Seconds to wait according to a Retry-After header, or None.'''
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    if value is None:
+        return None
+    seconds = parseduration(value)
+    if seconds is not None:
+        return seconds
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt, base=1.0, cap=60.0):
+    '''Exponential backoff with full jitter.'''
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    '''
+    Token bucket refilled at `per_minute` units per minute that holds at most
+    `burst` minutes of refill. reserve() takes units right away, letting the
+    level go negative, and returns how long the caller has to wait before
+    using them, so requests are spaced at the refill rate and large requests
+    are never starved.
+    '''
+
+    def __init__(self, per_minute, burst=1 / 60):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.level = per_minute * burst
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, factor=1.0):
+        rate = self.per_minute * factor / 60
+        now = time.monotonic()
+        self.level = min(self.per_minute * self.burst, self.level + (now - self.updated) * rate)
+        self.updated = now
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / rate
+
+
+class RateLimiter:
+    '''
+    Requests/min and tokens/min scheduler for one API provider, shared by all
+    threads that call it.
+
+    The configured limits are the ceiling. The limiter follows the provider's
+    x-ratelimit-* headers and on a 429 it pauses every caller for the
+    Retry-After time (or a jittered backoff) and lowers its rate; every
+    successful request raises the rate again, so it settles at the highest
+    rate the provider sustains. The 429s of one burst count as a single
+    congestion event, so the rate is lowered at most once per `cooldown`
+    seconds. Without configured limits it starts unthrottled and adopts the
+    limit reported by the provider, or the observed request rate, at the
+    first 429.
+    '''
+
+    def __init__(self, rpm=None, tpm=None, decrease=0.7, increase=0.02, floor=0.05, cooldown=1.0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.decrease = decrease
+        self.increase = increase
+        self.floor = floor
+        self.cooldown = cooldown
+        self.decreased = 0.0
+        self.factor = 1.0
+        self.blocked = 0.0
+        self.history = deque()
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=0):
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, self.factor))
+            if self.tokens is not None and tokens:
+                wait = max(wait, self.tokens.reserve(tokens, self.factor))
+            self.history.append(now + wait)
+            while self.history and self.history[0] < now - 60:
+                self.history.popleft()
+        if wait > 0:
+            time.sleep(wait)
+
+    def update(self, headers):
+        '''Pause until the reset time when the provider reports an exhausted quota.'''
+        waits = []
+        for kind in ('requests', 'tokens'):
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            reset = parseduration(headers.get(f'x-ratelimit-reset-{kind}'))
+            if remaining is not None and reset is not None and remaining.strip() == '0':
+                waits.append(reset)
+        if waits:
+            with self.lock:
+                self.blocked = max(self.blocked, time.monotonic() + max(waits))
+
+    def success(self):
+        with self.lock:
+            self.factor = min(1.0, self.factor + self.increase)
+
+    def throttle(self, headers, attempt):
+        '''Handle a 429: pause all callers and lower the rate.'''
+        wait = retryafter(headers)
+        if wait is None:
+            wait = backoff(attempt)
+        else:
+            wait += random.uniform(0, 0.1 * wait + 0.1)
+        with self.lock:
+            now = time.monotonic()
+            self.throttled += 1
+            if self.requests is None:
+                limit = headers.get('x-ratelimit-limit-requests')
+                try:
+                    rpm = float(limit)
+                except (TypeError, ValueError):
+                    span = max(1.0, now - self.history[0]) if self.history else 60.0
+                    rpm = max(1.0, len(self.history) * 60 / span)
+                self.requests = TokenBucket(rpm)
+            if now - self.decreased > max(self.cooldown, wait):
+                self.factor = max(self.floor, self.factor * self.decrease)
+                self.decreased = now
+            self.blocked = max(self.blocked, now + wait)
+
+    def stats(self):
+        return {'factor': self.factor, 'throttled': self.throttled}
+
+
+_limiters = {}
+_settings = {'rpm': None, 'tpm': None}
+_lock = threading.Lock()
+
+
+def configure(rpm=None, tpm=None, provider=None):
+    '''Set the requests/min and tokens/min ceiling of one provider, or the default of all.'''
+    with _lock:
+        if provider is None:
+            _settings.update(rpm=rpm, tpm=tpm)
+            _limiters.clear()
+        else:
+            _limiters[provider] = RateLimiter(rpm, tpm)
+
+
+def getlimiter(provider):
+    with _lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter(_settings['rpm'], _settings['tpm'])
+        return _limiters[provider]
+
+
+def estimatetokens(payload):
+    '''Rough token count of a chat request: prompt characters / 4 plus max_tokens.'''
+    if not isinstance(payload, dict):
+        return 0
+    chars = sum(len(str(message.get('content', ''))) for message in payload.get('messages', []))
+    return chars // 4 + int(payload.get('max_tokens') or 0)
@@ -0,0 +1,80 @@
+import importlib
+
+
+class Backend:
+    '''
+    A model backend: the class to load, given as 'module:Class' so that the
+    module (and torch, transformers or google.genai with it) is only
+    imported when the backend is selected, the --modelname values it
+    handles and the evalue.py options passed to its constructor.
+    '''
+
+    def __init__(self, name, target, match, params=()):
+        self.name = name
+        self.target = target
+        self.match = match
+        self.params = tuple(params)
+
+    def load(self):
+        module, cls = self.target.split(':')
+        return getattr(importlib.import_module(module), cls)
+
+    def create(self, args=None):
+        kwargs = {param: getattr(args, param) for param in self.params}
+        return self.load()(**kwargs)
+
+
+_backends = []
+
+
+def register(name, target, match=None, params=(), first=False):
+    '''
+    Declare a backend. `match` is a callable on the model name, a substring
+    or a tuple of substrings of it, by default the backend name itself.
+    Backends are tried in registration order; first=True puts the backend
+    before all others, e.g. to take over model names from a built-in one.
+    '''
+    backend = Backend(name, target, _matcher(match if match is not None else name), params)
+    if first:
+        _backends.insert(0, backend)
+    else:
+        _backends.append(backend)
+    return backend
+
+
+def _matcher(match):
+    if callable(match):
+        return match
+    if isinstance(match, str):
+        match = (match,)
+    return lambda modelname: any(part in modelname for part in match)
+
+
+def getbackend(modelname):
+    for backend in _backends:
+        if backend.match(modelname):
+            return backend
+    raise ValueError(f'no model backend for {modelname!r}, known backends: {", ".join(names())}')
+
+
+def getmodel(modelname, args=None):
+    '''Instantiate the model for --modelname, importing only its backend.'''
+    return getbackend(modelname).create(args)
+
+
+def names():
+    return [backend.name for backend in _backends]
+
+
+# The built-in backends, in the order evalue.py used to test --modelname.
+register('chatgpt', 'models.api:OpenAIAPIModel', match=lambda modelname: modelname == 'chatgpt', params=('api_key', 'url'))
+register('Llama-2', 'models.models:Llama2')
+register('Llama-3', 'models.api:Llama3Model', match=('Llama-3', 'Llama3'))
+register('chatglm', 'models.models:ChatglmModel', params=('plm',))
+register('moss', 'models.models:Moss', params=('plm',))
+register('vicuna', 'models.models:Vicuna', params=('plm',))
+register('Baichuan', 'models.models:Baichuan', params=('plm',))
+register('WizardLM', 'models.models:WizardLM', params=('plm',))
+register('BELLE', 'models.models:BELLE', params=('plm',))
+register('Qwen', 'models.api:QwenGroq')
+register('GeminiModel', 'models.gemini:GeminiModel')
@@ -0,0 +1,84 @@
+import json
+import re
+
+
+# The phrases scoring.getlabels() labels as a refusal ([-1]) whatever
+# else the response says, from the canned answers in config/instruction.yaml.
+REFUSALS = ['insufficient information', '信息不足']
+
+# Ends of a sentence; a decimal point or abbreviation also counts, which
+# only stops a little early after a refusal that is already decided.
+BOUNDARY = re.compile(r'[.!?。！？\n]')
+
+POLICIES = ['none', 'refusal']
+
+
+class StopPolicy:
+    '''
+    Where a response can end without changing its labels.
+
+    With the 'refusal' policy a response can stop at the end of the
+    sentence in which it writes one of `phrases` (the refusal phrases by
+    default), since the refusal decides its label. "factual errors" is no
+    stop phrase, as the corrected answer follows it. max_tokens caps the
+    response length for API models, which are sent it as max_tokens.
+    '''
+
+    def __init__(self, policy='refusal', phrases=None, max_tokens=None):
+        if policy not in POLICIES:
+            raise ValueError(f'stop policy must be one of {", ".join(POLICIES)}, not {policy!r}')
+        self.policy = policy
+        self.phrases = list(REFUSALS if phrases is None else phrases) if policy != 'none' else []
+        self.max_tokens = max_tokens
+
+    def stopat(self, text):
+        '''Length of the shortest prefix of text after which generation can stop, or None.'''
+        stops = []
+        for phrase in self.phrases:
+            start = text.find(phrase)
+            if start < 0:
+                continue
+            boundary = BOUNDARY.search(text, start + len(phrase))
+            if boundary is not None:
+                stops.append(boundary.end())
+        return min(stops) if stops else None
+
+    def truncate(self, text):
+        '''text as it would be if generation had stopped where the policy allows.'''
+        stop = self.stopat(text)
+        return text if stop is None else text[:stop]
+
+    def name(self):
+        '''Everything of the policy that changes the responses, for cache keys.'''
+        return json.dumps([self.policy, self.phrases, self.max_tokens], ensure_ascii=False)
+
+    def capped(self, max_tokens):
+        if self.max_tokens is None:
+            return max_tokens
+        if max_tokens is None:
+            return self.max_tokens
+        return min(max_tokens, self.max_tokens)
+
+
+def addarguments(parser):
+    '''Add the stopping options to an argparse parser.'''
+    parser.add_argument(
+        '--early_stop', type=str, default='none',
+        help='stop generating at the end of the sentence that contains a refusal phrase (refusal), or not (none)',
+        choices=POLICIES
+    )
+    parser.add_argument(
+        '--stop_phrases', type=str, nargs='+', default=None,
+        help='phrases that end generation with --early_stop refusal, instead of the refusal phrases the scoring looks for'
+    )
+    parser.add_argument(
+        '--stop_max_tokens', type=int, default=None,
+        help='cap on the response tokens requested from API models'
+    )
+
+
+def fromargs(args):
+    '''The policy chosen on the command line, None if nothing is stopped early.'''
+    if args.early_stop == 'none' and args.stop_max_tokens is None:
+        return None
+    return StopPolicy(args.early_stop, args.stop_phrases, args.stop_max_tokens)
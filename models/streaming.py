@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+
+from models.transport import gettransport
+
+
+_local = threading.local()
+
+
+def getstats():
+    '''Stats of the last generate() call of this thread, None if it recorded none.'''
+    return getattr(_local, 'stats', None)
+
+
+def setstats(stats):
+    _local.stats = stats
+
+
+def clearstats():
+    _local.stats = None
+
+
+def makestats(start, first, end, prompt_tokens, completion_tokens, source):
+    '''
+    Latency profile of one generation. ttft is the time to the first token
+    (None when the response was not streamed) and tokens_per_s the decode
+    rate after it. source tells where the token counts come from: the
+    provider's usage field, the tokenizer, or the number of streamed chunks
+    when the provider reports no usage.
+    '''
+    seconds = end - start
+    if first is not None and completion_tokens and completion_tokens > 1 and end > first:
+        tokens_per_s = (completion_tokens - 1) / (end - first)
+    elif completion_tokens and seconds > 0:
+        tokens_per_s = completion_tokens / seconds
+    else:
+        tokens_per_s = None
+    return {
+        'ttft': None if first is None else round(first - start, 6),
+        'seconds': round(seconds, 6),
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'tokens_per_s': None if tokens_per_s is None else round(tokens_per_s, 3),
+        'tokens': source,
+    }
+
+
+def getusage(data):
+    # Groq puts the usage of a stream into x_groq
+    usage = data.get('usage') or (data.get('x_groq') or {}).get('usage')
+    return usage or None
+
+
+def readstream(response, start, stopping=None):
+    '''
+    Read a server-sent events chat completion stream into (text, stats).
+    With a stop policy the stream is closed as soon as the policy lets the
+    text end, which also ends the generation on the server.
+    '''
+    parts = []
+    first = None
+    chunks = 0
+    usage = None
+    # event streams are always UTF-8, whatever the Content-Type says
+    for line in response.iter_lines():
+        line = line.decode('utf-8', errors='replace')
+        if not line.startswith('data:'):
+            continue
+        line = line[5:].strip()
+        if line == '[DONE]':
+            break
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        usage = getusage(data) or usage
+        for choice in data.get('choices') or []:
+            content = (choice.get('delta') or {}).get('content')
+            if content:
+                if first is None:
+                    first = time.perf_counter()
+                chunks += 1
+                parts.append(content)
+        if stopping is not None and stopping.phrases and stopping.stopat(''.join(parts)) is not None:
+            response.close()
+            break
+    end = time.perf_counter()
+    if usage is not None:
+        stats = makestats(start, first, end, usage.get('prompt_tokens'), usage.get('completion_tokens'), 'usage')
+    else:
+        stats = makestats(start, first, end, None, chunks, 'chunks')
+    return ''.join(parts), stats
+
+
+def chat(url, headers, payload, stream=False, verify=True, stopping=None):
+    '''
+    Send a chat completion request, streamed if stream is set, and record
+    its stats for getstats(). Returns the response and the completion text,
+    which is None if the request failed or has no choices. A stop policy
+    caps max_tokens, and ends streamed responses early.
+    '''
+    clearstats()
+    if stopping is not None and stopping.capped(payload.get('max_tokens')) is not None:
+        payload = dict(payload, max_tokens=stopping.capped(payload.get('max_tokens')))
+    if stream:
+        payload = dict(payload, stream=True, stream_options={'include_usage': True})
+    start = time.perf_counter()
+    response = gettransport().post(url, headers=headers, json=payload, verify=verify, stream=stream)
+    if response.status_code != 200:
+        return response, None
+    if stream:
+        text, stats = readstream(response, start, stopping)
+        # hands the connection back, and ends the recording of the stream
+        response.close()
+    else:
+        data = response.json()
+        try:
+            text = data['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            return response, None
+        usage = getusage(data) or {}
+        stats = makestats(start, None, time.perf_counter(), usage.get('prompt_tokens'), usage.get('completion_tokens'), 'usage' if usage else None)
+    cassette = gettransport().cassette
+    if cassette is not None and cassette.mode == 'replay':
+        # the timings of a replayed response are those of reading memory
+        stats.update(ttft=None, seconds=None, tokens_per_s=None, replayed=True)
+    setstats(stats)
+    return response, text
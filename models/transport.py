@@ -0,0 +1,183 @@
+import argparse
+import gzip
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+from models import ratelimit
+from models.cassette import Cassette
+
+
+class Transport:
+    '''
+    HTTP transport shared by the API model classes and the judge.
+
+    One requests.Session keeps connections alive across calls, so only the
+    first request to a host pays for the TCP and TLS handshakes. The pool
+    should be at least as large as the number of concurrent requests.
+    Responses are always accepted gzip-compressed; with gzip_requests=True
+    the JSON request bodies are compressed too (only for endpoints that
+    accept Content-Encoding: gzip).
+
+    Every request goes through the rate limiter of its host. Responses with
+    status 429, or 5xx, are retried up to max_retries times after the wait
+    the limiter derives from Retry-After or a jittered backoff.
+
+    With a cassette in record mode the response returned by post() is also
+    appended to it; in replay mode post() answers from the cassette only.
+    '''
+
+    def __init__(self, pool_size=10, connect_timeout=10, read_timeout=300, gzip_requests=False, max_retries=8, cassette=None):
+        self.cassette = cassette
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.timeout = (connect_timeout, read_timeout)
+        self.gzip_requests = gzip_requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    def post(self, url, json=None, headers=None, verify=True, stream=False):
+        if self.cassette is not None and self.cassette.mode == 'replay':
+            return self.cassette.replay(url, json)
+        response = self.request(url, json, headers, verify, stream)
+        if self.cassette is not None:
+            self.cassette.record(url, json, response, stream)
+        return response
+
+    def request(self, url, json=None, headers=None, verify=True, stream=False):
+        limiter = ratelimit.getlimiter(urlparse(url).netloc)
+        tokens = ratelimit.estimatetokens(json)
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire(tokens)
+            response = self.send(url, json, headers, verify, stream)
+            limiter.update(response.headers)
+            if response.status_code == 429:
+                limiter.throttle(response.headers, attempt)
+            elif response.status_code >= 500:
+                if attempt < self.max_retries:
+                    time.sleep(ratelimit.backoff(attempt))
+            else:
+                limiter.success()
+                return response
+            if attempt < self.max_retries:
+                response.close()
+        return response
+
+    def send(self, url, json=None, headers=None, verify=True, stream=False):
+        headers = dict(headers or {})
+        if self.gzip_requests and json is not None:
+            headers['Content-Type'] = 'application/json'
+            headers['Content-Encoding'] = 'gzip'
+            data = gzip.compress(dumps(json).encode('utf-8'))
+            return self.session.post(url, data=data, headers=headers, timeout=self.timeout, verify=verify, stream=stream)
+        return self.session.post(url, json=json, headers=headers, timeout=self.timeout, verify=verify, stream=stream)
+
+    def close(self):
+        self.session.close()
+        if self.cassette is not None:
+            self.cassette.close()
+
+
+def dumps(payload):
+    return json.dumps(payload, ensure_ascii=False)
+
+
+_transport = None
+_lock = threading.Lock()
+
+
+def configure(pool_size=10, connect_timeout=10, read_timeout=300, gzip_requests=False, max_retries=8, cassette=None):
+    '''Replace the shared transport, e.g. to size its pool to --concurrency.'''
+    global _transport
+    with _lock:
+        if _transport is not None:
+            _transport.close()
+        _transport = Transport(pool_size, connect_timeout, read_timeout, gzip_requests, max_retries, cassette)
+    return _transport
+
+
+def gettransport():
+    global _transport
+    with _lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
+
+
+def parselimit(value):
+    '''Parse "HOST=RPM" or "HOST=RPM:TPM" into (host, rpm, tpm).'''
+    try:
+        host, limits = value.split('=')
+        rpm, _, tpm = limits.partition(':')
+        return host, float(rpm) if rpm else None, float(tpm) if tpm else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'limit must be given as HOST=RPM or HOST=RPM:TPM, not {value!r}')
+
+
+def addarguments(parser):
+    '''Add the transport options to an argparse parser.'''
+    parser.add_argument(
+        '--connect_timeout', type=float, default=10,
+        help='connect timeout of API requests in seconds'
+    )
+    parser.add_argument(
+        '--read_timeout', type=float, default=300,
+        help='read timeout of API requests in seconds'
+    )
+    parser.add_argument(
+        '--gzip', action='store_true',
+        help='gzip-compress API request bodies'
+    )
+    parser.add_argument(
+        '--rpm', type=float, default=None,
+        help='requests per minute allowed by the API provider'
+    )
+    parser.add_argument(
+        '--tpm', type=float, default=None,
+        help='tokens per minute allowed by the API provider'
+    )
+    parser.add_argument(
+        '--provider_limit', type=parselimit, nargs='+', default=[], metavar='HOST=RPM[:TPM]',
+        help='requests (and tokens) per minute of single API hosts, e.g. api.groq.com=30:6000, instead of --rpm and --tpm'
+    )
+    parser.add_argument(
+        '--max_retries', type=int, default=8,
+        help='number of retries of a rate-limited or failed API request'
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--record', type=str, default=None, metavar='CASSETTE',
+        help='record the API requests and responses to this cassette file (.jsonl or .jsonl.gz)'
+    )
+    group.add_argument(
+        '--replay', type=str, default=None, metavar='CASSETTE',
+        help='answer API requests from this cassette file instead of the network'
+    )
+
+
+def configurefromargs(args, concurrency=1):
+    ratelimit.configure(args.rpm, args.tpm)
+    for host, rpm, tpm in args.provider_limit:
+        ratelimit.configure(rpm, tpm, provider=host)
+    cassette = None
+    if args.record:
+        cassette = Cassette(args.record, 'record')
+    elif args.replay:
+        cassette = Cassette(args.replay, 'replay')
+    return configure(max(10, concurrency), args.connect_timeout, args.read_timeout, args.gzip, args.max_retries, cassette)
+
+
+def close():
+    '''Close the shared transport, which also flushes a cassette being recorded.'''
+    global _transport
+    with _lock:
+        if _transport is not None:
+            _transport.close()
+            _transport = None
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import math
+import os
+import random
+
+
+# A doc is referred to by [field, i] or, for the grouped positives of the
+# _int datasets, [field, i, j], with field an index into DOCFIELDS.
+DOCFIELDS = ['positive', 'negative', 'positive_wrong']
+POSITIVE, NEGATIVE, POSITIVE_WRONG = range(3)
+
+
+def sampledocs(instance, noise_rate, passage_num, filename, correct_rate = 0, rng = random):
+    '''
+    Choose the docs of an instance and return them as refs (see DOCFIELDS).
+    Draws from `rng` in the same order as the original processdata(), so
+    resolving the refs gives the same docs for the same random state.
+    '''
+    neg_num = math.ceil(passage_num * noise_rate)
+    pos_num = passage_num - neg_num
+
+    if '_int' in filename:
+        orders = []
+        for group in instance['positive']:
+            order = list(range(len(group)))
+            rng.shuffle(order)
+            orders.append(order)
+        docs = [[POSITIVE, i, order[0]] for i, order in enumerate(orders)]
+        if len(docs) < pos_num:
+            maxnum = max([len(order) for order in orders])
+            for j in range(1,maxnum):
+                for i, order in enumerate(orders):
+                    if len(order) > j:
+                        docs.append([POSITIVE, i, order[j]])
+                        if len(docs) == pos_num:
+                            break
+                if len(docs) == pos_num:
+                    break
+        neg_num = passage_num - len(docs)
+        if neg_num > 0:
+            docs += [[NEGATIVE, i] for i in range(min(neg_num, len(instance['negative'])))]
+    elif '_fact' in filename:
+        correct_num = math.ceil(passage_num * correct_rate)
+        pos_num = passage_num - neg_num - correct_num
+        indexs = list(range(len(instance['positive'])))
+        selected = rng.sample(indexs,min(len(indexs),pos_num))
+        docs = [[POSITIVE_WRONG, i] for i in selected]
+        remain = [i for i in indexs if i not in selected]
+        if correct_num > 0 and len(remain) > 0:
+            docs += [[POSITIVE, i] for i in rng.sample(remain,min(len(remain),correct_num))]
+        if neg_num > 0:
+            docs += [[NEGATIVE, i] for i in range(min(neg_num, len(instance['negative'])))]
+    else:
+        if noise_rate == 1:
+            neg_num = passage_num
+            pos_num = 0
+        else:
+            if neg_num > len(instance['negative']):
+                neg_num = len(instance['negative'])
+                pos_num = passage_num - neg_num
+            elif pos_num > len(instance['positive']):
+                pos_num = len(instance['positive'])
+                neg_num = passage_num - pos_num
+
+        docs = [[POSITIVE, i] for i in range(min(pos_num, len(instance['positive'])))]
+        docs += [[NEGATIVE, i] for i in range(min(neg_num, len(instance['negative'])))]
+
+    rng.shuffle(docs)
+
+    return docs
+
+
+def resolve(instance, refs):
+    '''Texts of the docs referred to by refs.'''
+    docs = []
+    for ref in refs:
+        doc = instance[DOCFIELDS[ref[0]]][ref[1]]
+        if len(ref) == 3:
+            doc = doc[ref[2]]
+        docs.append(doc)
+    return docs
+
+
+def getrng(seed, id):
+    '''Random generator of one instance, independent of all other instances.'''
+    digest = hashlib.sha256(f'{seed}:{id}'.encode('utf-8')).digest()
+    return random.Random(int.from_bytes(digest[:8], 'big'))
+
+
+def compileplan(instances, dataset, noise_rate, passage_num, correct_rate = 0, seed = 2333):
+    '''
+    Sample the docs of every instance with its own generator and return a
+    dict id -> refs (None where the instance cannot be sampled).
+    '''
+    plan = {}
+    for instance in instances:
+        if passage_num == 0:
+            plan[instance['id']] = []
+            continue
+        try:
+            plan[instance['id']] = sampledocs(instance, noise_rate, passage_num, dataset, correct_rate, getrng(seed, instance['id']))
+        except Exception as e:
+            print("Error:", e)
+            plan[instance['id']] = None
+    return plan
+
+
+def getplanpath(plandir, dataset, noise_rate, passage_num, correct_rate, seed):
+    return f'{plandir}/plan_{dataset}_noise{noise_rate}_passage{passage_num}_correct{correct_rate}_seed{seed}.json'
+
+
+def getplan(instances, datafile, dataset, noise_rate, passage_num, correct_rate = 0, seed = 2333, plandir = 'plans'):
+    '''
+    Plan of a config, read from its plan file in `plandir` or compiled and
+    written there. A plan file is compiled again when the size or
+    modification time of the dataset file changes.
+    '''
+    stat = os.stat(datafile)
+    source = [stat.st_size, stat.st_mtime_ns]
+    path = getplanpath(plandir, dataset, noise_rate, passage_num, correct_rate, seed)
+    if os.path.exists(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved['source'] == source:
+                return {id: refs for id, refs in saved['plan']}
+        except (ValueError, KeyError):
+            pass
+    plan = compileplan(instances, dataset, noise_rate, passage_num, correct_rate, seed)
+    os.makedirs(plandir, exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'source': source, 'seed': seed, 'plan': list(plan.items())}, f, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+    return plan
@@ -0,0 +1,104 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+from multiprocessing import Pool
+
+from scoring import getscores, relabel
+
+
+FILEPATTERN = re.compile(
+    r'prediction_(en_int|zh_int|en_fact|zh_fact|en|zh)_(.+)_temp([\d.]+)_noise([\d.]+)_passage(\d+)_correct([\d.]+)\.json$'
+)
+
+COLUMNS = [
+    'file', 'dataset', 'model', 'temp', 'noise', 'passage', 'correct', 'nums', 'tt', 'all_rate',
+    'accuracy', 'fact_tt', 'fact_check_rate', 'correct_tt', 'correct_rate',
+]
+
+
+def parsefilename(filename):
+    '''Return the config encoded in a prediction file name, or None for other files.'''
+    match = FILEPATTERN.search(os.path.basename(filename))
+    if match is None:
+        return None
+    dataset, model, temp, noise, passage, correct = match.groups()
+    return {
+        'dataset': dataset,
+        'model': model,
+        'temp': float(temp),
+        'noise': float(noise),
+        'passage': int(passage),
+        'correct': float(correct),
+    }
+
+
+def readrows(filename):
+    '''Read a prediction file, keeping the newest row of every id.'''
+    rows = {}
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            rows[row['id']] = row
+    return list(rows.values())
+
+
+def rescore(task):
+    filename, relabelrows, normalize = task
+    config = parsefilename(filename)
+    rows = readrows(filename)
+    if len(rows) == 0:
+        return None
+    if relabelrows:
+        relabel(rows, normalize)
+    scores = getscores(rows, config['model'], config['noise'], config['dataset'])
+    scores.update(config)
+    scores['file'] = filename
+    return scores
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='recompute the scores of existing prediction files without model calls')
+
+    parser.add_argument(
+        'patterns', type=str, nargs='*', default=['result-en/prediction_*.json', 'result-zh/prediction_*.json'],
+        help='glob patterns of prediction files'
+    )
+    parser.add_argument(
+        '--output', type=str, default='rescore.csv',
+        help='path of the consolidated table (.csv or .json)'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help='number of worker processes'
+    )
+    parser.add_argument(
+        '--relabel', action='store_true',
+        help='recompute the labels from the stored predictions instead of using the stored labels'
+    )
+    parser.add_argument(
+        '--normalize', action='store_true',
+        help='fold full-width forms (NFKC) when relabelling'
+    )
+
+    args = parser.parse_args()
+
+    files = sorted({f for pattern in args.patterns for f in glob.glob(pattern, recursive=True) if parsefilename(f)})
+    tasks = [(f, args.relabel, args.normalize) for f in files]
+    with Pool(max(1, args.workers)) as pool:
+        table = [scores for scores in pool.imap(rescore, tasks, chunksize=4) if scores is not None]
+
+    if args.output.endswith('.json'):
+        json.dump(table, open(args.output, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+    else:
+        with open(args.output, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(table)
+    print(f'Rescored {len(table)} files into {args.output}')
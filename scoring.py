@@ -0,0 +1,77 @@
+from matcher import AnswerMatcher, getmatcher
+
+
+def checkanswer(prediction, ground_truth):
+    return getmatcher(ground_truth).labels(prediction)
+
+
+def getlabels(prediction, ground_truth, dataset):
+    if 'zh' in dataset:
+        prediction = prediction.replace(" ","")
+
+    if '信息不足' in prediction or 'insufficient information' in prediction:
+        labels = [-1]
+    else:
+        labels = checkanswer(prediction, ground_truth)
+    
+    factlabel = 0
+
+    if '事实性错误' in prediction or 'factual errors' in prediction:
+        factlabel = 1
+
+    return labels,prediction, factlabel
+
+
+def relabel(rows, normalize=False):
+    '''
+    Recompute 'label' and 'factlabel' of prediction rows (as written by
+    evalue.py) from their stored predictions, with one AnswerMatcher for all
+    of their answers. The rows are updated in place and returned.
+    '''
+    rows = list(rows)
+    matcher = AnswerMatcher([row['ans'] for row in rows], normalize)
+    for k, row in enumerate(rows):
+        prediction = row['prediction']
+        if '信息不足' in prediction or 'insufficient information' in prediction:
+            row['label'] = [-1]
+        else:
+            row['label'] = matcher.labels(prediction, k)
+        row['factlabel'] = int('事实性错误' in prediction or 'factual errors' in prediction)
+    return rows
+
+
+def getscores(results, modelname, noise_rate, dataset):
+    tt = 0
+    for i in results:
+        label = i['label']
+        if noise_rate == 1 and label[0] == -1:
+            tt += 1
+        elif 0 not in label and 1 in label:
+            tt += 1
+    accuracy =  (1 - tt/len(results))*100
+    scores = {
+    'all_rate': (tt)/len(results),
+    'model': modelname,
+    'accuracy': accuracy,
+    'noise_rate': noise_rate,
+    'tt':tt,
+    'nums': len(results),
+    }
+    if '_fact' in dataset:
+        fact_tt = 0
+        correct_tt = 0
+        for i in results:
+            if i['factlabel'] == 1:
+                fact_tt += 1
+                if 0 not in i['label']:
+                    correct_tt += 1
+        fact_check_rate = fact_tt/len(results)
+        if fact_tt > 0:
+            correct_rate = correct_tt/fact_tt
+        else:
+            correct_rate = 0
+        scores['fact_check_rate'] = fact_check_rate
+        scores['correct_rate'] = correct_rate
+        scores['fact_tt'] = fact_tt
+        scores['correct_tt'] = correct_tt
+    return scores
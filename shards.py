@@ -0,0 +1,41 @@
+import json
+import os
+import zlib
+
+
+# Manifest fields that are the same for all shards of a run.
+CONFIGFIELDS = [
+    'dataset', 'model', 'plm', 'temp', 'noise_rate', 'passage_num', 'correct_rate', 'factchecking',
+    'plan', 'plan_seed', 'truncation', 'context_length', 'device', 'precision', 'shards', 'instances',
+]
+
+
+def parseshard(value):
+    '''Parse "i/N" into (i, N), with shards numbered 0 to N-1.'''
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f'shard must be given as i/N, not {value!r}')
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f'shard index must be between 0 and {count - 1}, not {index}')
+    return index, count
+
+
+def getshard(id, count):
+    '''Shard of an instance, from a CRC32 of its id, so it does not depend on the dataset order.'''
+    return zlib.crc32(str(id).encode('utf-8')) % count
+
+
+def getshardname(filename, index, count):
+    return f'{filename}_shard{index}of{count}'
+
+
+def writemanifest(path, manifest):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def readmanifest(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
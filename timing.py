@@ -0,0 +1,172 @@
+import json
+import math
+import os
+import threading
+import time
+
+
+class Stopwatch:
+    '''
+    Stage timings of one instance. lap(stage) adds the time since the
+    previous lap (or since the stopwatch was created or restarted) to stage.
+    '''
+    __slots__ = ('times', 'last')
+
+    def __init__(self):
+        self.times = {}
+        self.last = time.perf_counter()
+
+    def restart(self):
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.times[stage] = self.times.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def add(self, stage, seconds):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+
+
+class NullStopwatch:
+    '''Stopwatch of disabled timings, whose laps cost a method call.'''
+    __slots__ = ()
+    times = None
+
+    def restart(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def add(self, stage, seconds):
+        pass
+
+
+NULLWATCH = NullStopwatch()
+
+
+def percentile(values, q):
+    '''Nearest-rank percentile of a sorted list.'''
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'total': sum(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1],
+    }
+
+
+class Timings:
+    '''
+    Per-instance stage timings of a run, grouped by output file.
+
+    stopwatch() hands out a Stopwatch per instance (or the shared
+    NullStopwatch when disabled, so the hot path only pays for no-op calls),
+    and add() collects its stage times once the instance is done. The
+    summary has the count, total, mean and percentiles in seconds of every
+    stage; write() puts it with the per-instance timings into a JSON
+    sidecar and writeprometheus() into a Prometheus text-format file.
+    '''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.instances = {}
+        self.run = {}
+        self.start = time.perf_counter()
+
+    def stopwatch(self):
+        if not self.enabled:
+            return NULLWATCH
+        return Stopwatch()
+
+    def add(self, group, id, watch):
+        if watch.times is None:
+            return
+        with self.lock:
+            self.instances.setdefault(group, []).append({'id': id, **watch.times})
+
+    def addrun(self, group, stage, seconds):
+        '''Time of a stage that runs once per group, e.g. scoring.'''
+        if not self.enabled:
+            return
+        with self.lock:
+            self.run.setdefault(group, {})[stage] = seconds
+
+    def summary(self, group):
+        stages = {}
+        for instance in self.instances.get(group, []):
+            for stage, seconds in instance.items():
+                if stage != 'id':
+                    stages.setdefault(stage, []).append(seconds)
+        return {stage: summarize(values) for stage, values in stages.items()}
+
+    def write(self, group, path):
+        if not self.enabled:
+            return
+        report = {
+            'seconds': time.perf_counter() - self.start,
+            'stages': self.summary(group),
+            'run': self.run.get(group, {}),
+            'instances': self.instances.get(group, []),
+        }
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def writeprometheus(self, path, prefix='rgb'):
+        '''Write the stage summaries of all groups, labelled by group, in the Prometheus text format.'''
+        if not self.enabled:
+            return
+        lines = [
+            f'# HELP {prefix}_stage_seconds Time per instance spent in each pipeline stage.',
+            f'# TYPE {prefix}_stage_seconds summary',
+        ]
+        for group in sorted(self.instances):
+            for stage, summary in sorted(self.summary(group).items()):
+                labels = f'group="{escape(group)}",stage="{stage}"'
+                for quantile in ('p50', 'p90', 'p99'):
+                    lines.append(f'{prefix}_stage_seconds{{{labels},quantile="0.{quantile[1:]}"}} {summary[quantile]:.6f}')
+                lines.append(f'{prefix}_stage_seconds_sum{{{labels}}} {summary["total"]:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{{labels}}} {summary["count"]}')
+        lines.append(f'# HELP {prefix}_run_stage_seconds Time spent in stages that run once per group.')
+        lines.append(f'# TYPE {prefix}_run_stage_seconds gauge')
+        for group in sorted(self.run):
+            for stage, seconds in sorted(self.run[group].items()):
+                lines.append(f'{prefix}_run_stage_seconds{{group="{escape(group)}",stage="{stage}"}} {seconds:.6f}')
+        lines.append(f'# HELP {prefix}_run_seconds Wall time of the run.')
+        lines.append(f'# TYPE {prefix}_run_seconds gauge')
+        lines.append(f'{prefix}_run_seconds {time.perf_counter() - self.start:.6f}')
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def addarguments(parser):
+    '''Add the timing options to an argparse parser.'''
+    parser.add_argument(
+        '--timing', action='store_true',
+        help='time every stage of every instance and write a _timing.json file next to the results'
+    )
+    parser.add_argument(
+        '--prometheus', type=str, default=None,
+        help='also write the stage timings to this file in the Prometheus text format (implies --timing)'
+    )
+
+
+def fromargs(args):
+    return Timings(args.timing or args.prometheus is not None)
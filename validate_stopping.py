@@ -0,0 +1,102 @@
+import argparse
+import copy
+import glob
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+from budget import estimatetokens
+from models.stopping import StopPolicy
+from rescore import parsefilename, readrows
+from scoring import relabel
+
+
+def validate(task):
+    '''
+    Compare the labels of the stored predictions of a file with those of
+    the same predictions cut where the stop policy would have ended them.
+    A response generated with early stopping is the prefix of the full one
+    (the tokens before the stop are sampled the same way), so this tells
+    whether the policy changes any label without generating again.
+    '''
+    filename, phrases, normalize = task
+    rows = readrows(filename)
+    if len(rows) == 0:
+        return None
+    policy = StopPolicy('refusal', phrases)
+    stopped = copy.deepcopy(rows)
+    for row in stopped:
+        row['prediction'] = policy.truncate(row['prediction'])
+    relabel(rows, normalize)
+    relabel(stopped, normalize)
+    result = {
+        'file': filename,
+        'rows': len(rows),
+        'stopped': 0,
+        'label_changes': 0,
+        'fact_changes': 0,
+        'tokens': 0,
+        'saved_tokens': 0,
+        'changed_ids': [],
+    }
+    for full, cut in zip(rows, stopped):
+        tokens = estimatetokens(full['prediction'])
+        result['tokens'] += tokens
+        if cut['prediction'] != full['prediction']:
+            result['stopped'] += 1
+            result['saved_tokens'] += tokens - estimatetokens(cut['prediction'])
+        changed = False
+        if cut['label'] != full['label']:
+            result['label_changes'] += 1
+            changed = True
+        if cut['factlabel'] != full['factlabel']:
+            result['fact_changes'] += 1
+            changed = True
+        if changed:
+            result['changed_ids'].append(full['id'])
+    return result
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='check on existing prediction files that --early_stop refusal leaves the labels unchanged, and how many decode tokens it saves')
+
+    parser.add_argument(
+        'patterns', type=str, nargs='*', default=['result-en/prediction_*.json', 'result-zh/prediction_*.json'],
+        help='glob patterns of prediction files'
+    )
+    parser.add_argument(
+        '--stop_phrases', type=str, nargs='+', default=None,
+        help='phrases that end generation, the refusal phrases the scoring looks for if not given'
+    )
+    parser.add_argument(
+        '--normalize', action='store_true',
+        help='fold full-width forms (NFKC) when relabelling'
+    )
+    parser.add_argument(
+        '--output', type=str, default=None,
+        help='path of a JSON report with the results of every file'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help='number of worker processes'
+    )
+
+    args = parser.parse_args()
+
+    files = sorted({f for pattern in args.patterns for f in glob.glob(pattern, recursive=True) if parsefilename(f)})
+    tasks = [(f, args.stop_phrases, args.normalize) for f in files]
+    with Pool(max(1, args.workers)) as pool:
+        results = [result for result in pool.imap(validate, tasks, chunksize=4) if result is not None]
+
+    total = {key: sum(result[key] for result in results) for key in ('rows', 'stopped', 'label_changes', 'fact_changes', 'tokens', 'saved_tokens')}
+    for result in results:
+        if result['label_changes'] or result['fact_changes']:
+            print(f"{result['file']}: {result['label_changes']} label and {result['fact_changes']} factlabel changes, ids {result['changed_ids'][:10]}")
+    if args.output:
+        json.dump({'total': total, 'files': results}, open(args.output, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+    print(f"{len(results)} files, {total['rows']} predictions: {total['stopped']} stopped early, "
+          f"{total['label_changes']} label and {total['fact_changes']} factlabel changes, "
+          f"{total['saved_tokens']} of {total['tokens']} estimated response tokens saved")
+    sys.exit(1 if total['label_changes'] or total['fact_changes'] else 0)
@@ -0,0 +1,137 @@
+import importlib
+import multiprocessing
+import os
+
+from models import devices, registry, stopping, streaming
+
+
+_model = None
+_error = None
+_barrier = None
+
+
+def setthreads(threads):
+    '''Pin the number of torch (and OpenMP/MKL) threads of this process.'''
+    # must be set before torch starts its thread pools
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def _init(modelname, args, threads, barrier=None):
+    global _model, _error, _barrier
+    _barrier = barrier
+    try:
+        if threads:
+            setthreads(threads)
+        for module in getattr(args, 'model_module', []):
+            importlib.import_module(module)
+        if hasattr(args, 'precision'):
+            devices.configurefromargs(args)
+        _model = registry.getmodel(modelname, args)
+        if getattr(args, 'draft_plm', None):
+            setdraft(_model, args.draft_plm)
+        if getattr(args, 'stream', False):
+            setstream(_model)
+        if hasattr(args, 'early_stop'):
+            policy = stopping.fromargs(args)
+            if policy is not None:
+                setstopping(_model, policy)
+    except Exception as e:
+        # a failing initializer would make the pool restart the worker
+        # forever, so the error is raised by the first call instead
+        _error = e
+
+
+def _ready():
+    if _error is not None:
+        raise RuntimeError(f'worker could not load the model: {_error!r}')
+
+
+def _started(i):
+    # every worker blocks here until all have taken one call, so each
+    # worker checks its own model
+    _barrier.wait()
+    _ready()
+
+
+def _generate(text, args, kwargs):
+    _ready()
+    streaming.clearstats()
+    return _model.generate(text, *args, **kwargs), streaming.getstats()
+
+
+def setstream(model):
+    '''Stream the responses of model, if it can. Returns whether it can.'''
+    if not hasattr(model, 'stream'):
+        return False
+    model.stream = True
+    return True
+
+
+def setdraft(model, plm):
+    '''Attach the draft model plm for assisted generation, if model can use one. Returns whether it can.'''
+    if not hasattr(model, 'setdraft'):
+        return False
+    model.setdraft(plm)
+    return True
+
+
+def setstopping(model, policy):
+    '''Let model stop generating where policy allows, if it can. Returns whether it can.'''
+    if not hasattr(model, 'stopping'):
+        return False
+    model.stopping = policy
+    return True
+
+
+class ProcessPoolModel:
+    '''
+    Runs a model in `workers` processes, each with its own copy of the
+    model and `threads` torch threads, for local models on CPU where one
+    process cannot use all cores.
+
+    generate() sends the prompt to the next free worker and blocks until
+    its response is back, so calling it from several threads (evalue.py
+    uses --concurrency threads, at least one per worker) keeps every
+    worker busy while rungeneration() still writes the results in order.
+    Workers are started with spawn, so they do not inherit the state of
+    the main process.
+    '''
+
+    def __init__(self, modelname, args, workers, threads=None):
+        if threads is None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+        self.modelname = modelname
+        self.workers = workers
+        self.threads = threads
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(workers)
+        self.pool = context.Pool(workers, initializer=_init, initargs=(modelname, args, threads, barrier))
+        try:
+            self.pool.map(_started, range(workers), chunksize=1)
+        except Exception:
+            self.pool.terminate()
+            raise
+
+    def generate(self, text, temperature=0.7, system=None, top_p=None, max_new_tokens=None):
+        args = [temperature]
+        if system is not None:
+            args.append(system)
+        kwargs = {}
+        if top_p is not None:
+            kwargs['top_p'] = top_p
+        if max_new_tokens is not None:
+            kwargs['max_new_tokens'] = max_new_tokens
+        text, stats = self.pool.apply(_generate, (text, args, kwargs))
+        # the stats of the worker's call, for getstats() in this thread
+        streaming.setstats(stats)
+        return text
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()